@@ -9,9 +9,12 @@ import csv
 import values
 import datetime
 import os
-from facial_recognition import recognize
+from facial_recognition.client import get_client, RecognitionServiceError
+from facial_recognition.jobs import get_job_queue, QueueFull
 from forms import LoginForm, RegistrationForm, AdminAddFileForm, ManualAttendanceForm, StudentRegistrationForm
 from models import app, db, Users, Staffs, Students, Courses, Indexes, StaffInCharged, IndexDates, Attendance, mail
+from roster import get_roster, warm_roster, evict_roster, sweep_rosters, attendance_statuses, mark_attendance
+from attendance_writer import get_attendance_writer
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 
 
@@ -146,6 +149,7 @@ def edit_account():
             account.staff[0].name = request.form[f'name_{account.id}']
             account.staff[0].role = request.form[f'role_{account.id}']
         db.session.commit()
+        evict_roster()
         flash('Successfully edited the accounts', 'success')
         return redirect(url_for('manage_account'))
 
@@ -168,6 +172,7 @@ def remove_account():
             for acc_id in remove_list:
                 db.session.delete(Users.query.get(acc_id))
             db.session.commit()
+            evict_roster()
             flash('Account(s) were removed', 'success')
             return redirect(url_for('manage_account'))
         flash('No account were removed', 'warning')
@@ -271,6 +276,7 @@ def edit_student():
         for student in students:
             student.name = request.form[f'name_{student.id}']
         db.session.commit()
+        evict_roster()
         flash('Successfully edited students', 'success')
         return redirect(url_for('manage_student'))
 
@@ -293,6 +299,7 @@ def remove_student():
             for student_id in remove_list:
                 db.session.delete(Students.query.get(student_id))
             db.session.commit()
+            evict_roster()
             flash('Student(s) details were removed', 'success')
             return redirect(url_for('manage_student'))
         flash('No student details were removed', 'warning')
@@ -434,6 +441,7 @@ def remove_course():
             for course_id in remove_list:
                 db.session.delete(Courses.query.get(course_id))
             db.session.commit()
+            evict_roster()
             flash('Course(s) were removed', 'success')
             return redirect(url_for('manage_course'))
         flash('No course were removed', 'info')
@@ -454,6 +462,7 @@ def remove_all_courses():
         for course in courses:
             db.session.delete(course)
         db.session.commit()
+        evict_roster()
         flash('Successfully removed all courses', 'success')
     else:
         flash('No courses were removed', 'info')
@@ -533,6 +542,7 @@ def upload_class():
 
         if added:
             db.session.commit()
+            evict_roster()
             flash('Class details have been added', 'success')
         else:
             flash('No class details was added', 'info')
@@ -582,6 +592,7 @@ def remove_students(index_id):
                     removed_entry = Attendance.query.filter_by(studentId=student_id, indexDateId=index_date.id).first()
                     db.session.delete(removed_entry)
             db.session.commit()
+            evict_roster()
             flash('Student was removed from the class', 'success')
             return redirect(url_for('view_class_students', index_id=index_id))
         flash('No student was removed from this class', 'info')
@@ -629,6 +640,7 @@ def add_student_to_class(index_id):
                 new_attendance = Attendance(indexDateId=index_date.id, studentId=request.form['name'], seatNo=seat_no)
                 db.session.add(new_attendance)
             db.session.commit()
+            evict_roster()
             flash('Student has successfully enroll into this class', 'success')
             return redirect(url_for('view_class_students', index_id=index_id))
 
@@ -653,6 +665,7 @@ def edit_student_seat_no(index_id):
             for attendance in index_date.attendance:
                 attendance.seatNo = request.form[f'seatNo_{attendance.studentId}']
             db.session.commit()
+        evict_roster()
         flash('Successfully changed the seat number', 'success')
         return redirect(url_for('view_class_students', index_id=index_id))
 
@@ -712,6 +725,7 @@ def edit_attendance(class_date_id):
         flash('You are not authorized to perform this action', 'danger')
         return redirect(url_for('dashboard'))
 
+    flush_attendance()
     attendances = Attendance.query.filter_by(indexDateId=class_date_id).all()
 
     if request.method == "POST":
@@ -797,6 +811,7 @@ def start_attendance(class_date_id):
     else:
         IndexDates.query.filter_by(id=class_date_id).first().attendance_started = True
         db.session.commit()
+        warm_attendance(class_date_id)
         flash('Successfully started the attendance', 'success')
     return redirect(url_for('view_class_dates', class_index=class_index.id))
 
@@ -811,10 +826,46 @@ def stop_attendance(class_date_id):
     class_date = IndexDates.query.filter_by(id=class_date_id).first()
     class_date.attendance_started = False
     db.session.commit()
+    flush_attendance()
+    evict_attendance(class_date_id)
     flash('Successfully stopped the attendance', 'success')
     return redirect(url_for('view_class_dates', class_index=class_date.index.id))
 
 
+def warm_attendance(class_date_id):
+    # load the roster and the enrolled students' embeddings now, so that the
+    # first kiosk request of the lecture is as fast as the following ones
+    # (only an optimization: on any failure, e.g. models that cannot be
+    # loaded, the first request builds the gallery instead)
+    try:
+        roster = warm_roster(class_date_id)
+        recognizer().warm(class_date_id, roster.matric_nos)
+    except Exception:
+        app.logger.warning('Unable to warm up the attendance of class date %s', class_date_id, exc_info=True)
+
+
+def evict_attendance(class_date_id):
+    evict_roster(class_date_id)
+    try:
+        recognizer().evict(class_date_id)
+    except Exception:
+        app.logger.warning('Unable to evict the attendance of class date %s', class_date_id, exc_info=True)
+
+
+@app.before_request
+def sweep_attendance():
+    # the other workers' share of stop_attendance: drop the rosters and
+    # candidate galleries of class dates that stopped taking attendance (a
+    # recognition service already dropped its gallery on stop, and a worker
+    # that has not loaded its engine has none)
+    stopped = sweep_rosters()
+    if stopped and not app.config['RECOGNITION_SERVICE']:
+        from facial_recognition.engine import loaded_engine
+        engine = loaded_engine()
+        for class_date_id in stopped if engine is not None else []:
+            engine.evict_candidates(class_date_id)
+
+
 def send_manual_attendance_email(attendance_id, matric_no, lab_tech_email, expires_sec=360):
     s = Serializer(app.config['SECRET_KEY'], expires_sec)
     token = s.dumps({'attendance_id': attendance_id,
@@ -835,41 +886,76 @@ Face It System
     mail.send(msg)
 
 
+def attendance_started(class_date_id):
+    return bool(db.session.query(IndexDates.attendance_started).filter(IndexDates.id == class_date_id).scalar())
+
+
+def attendance_writer():
+    # None when every mark is committed by the request that makes it
+    if not app.config['ATTENDANCE_WRITE_BEHIND']:
+        return None
+    return get_attendance_writer(journal_dir=app.config['ATTENDANCE_JOURNAL_DIR'],
+                                 flush_interval=app.config['ATTENDANCE_FLUSH_INTERVAL_MS'] / 1000,
+                                 flush_batch=app.config['ATTENDANCE_FLUSH_BATCH'],
+                                 fsync=app.config['ATTENDANCE_JOURNAL_FSYNC'])
+
+
+@app.before_first_request
+def start_attendance_writer():
+    # replay the marks journaled by a crashed worker as soon as the app starts
+    attendance_writer()
+
+
+def record_present(attendance_ids):
+    # journaled and committed by the next flush, or committed straight away
+    writer = attendance_writer()
+    if writer:
+        writer.mark(attendance_ids)
+    else:
+        mark_attendance(attendance_ids)
+
+
+def flush_attendance():
+    # commit the marks still buffered, before the attendance is edited or
+    # the attendance taking stops
+    writer = attendance_writer()
+    if writer:
+        writer.flush()
+
+
+def current_statuses(class_date_id, attendance_ids=None):
+    # the attendance statuses, counting marks that are not flushed yet
+    statuses = attendance_statuses(class_date_id, attendance_ids)
+    writer = attendance_writer()
+    if writer:
+        for attendance_id in writer.pending(statuses):
+            statuses[attendance_id] = 'Present'
+    return statuses
+
+
 @app.route('/take_attendance/<int:class_date_id>', methods=['GET', 'POST'])
 def take_attendance(class_date_id):
-    attendances = Attendance.query.filter_by(indexDateId=class_date_id).all()
+    roster = get_roster(class_date_id)
 
     form = ManualAttendanceForm()
-    attendance_started = attendances[0].indexDate.attendance_started
-    room_no = attendances[0].indexDate.index.room
-    if attendance_started:
+    if roster and attendance_started(class_date_id):
+        statuses = current_statuses(class_date_id)
         if form.validate_on_submit():
-            valid_matric = False
-            for attend in attendances:
-                if attend.student.matricNo == form.matricNo.data.upper():
-                    valid_matric = True
-                    if attend.attendance != "Present":
-                        lab_tech_email = ""
-                        for staff_in_charged in attend.indexDate.index.staffInCharged:
-                            if staff_in_charged.staff.role == "lab technician":
-                                lab_tech_email = staff_in_charged.staff.user.email
-                                break
-                        send_manual_attendance_email(attend.id, attend.student.matricNo, lab_tech_email)
-                        flash('Email has been sent to the lab technician. Please inform them', 'success')
-                    else:
-                        flash(f'Your attendance, {attend.student.matricNo}, has already been marked', 'info')
-                    # if attend.attendance != 'Present':
-                    #     attend.attendance = 'Present'
-                    #     db.session.commit()
-                    #     flash(f"Attendance has been taken for Student {form.matricNo.data.upper()}", "success")
-                    # else:
-                    #     flash(f"Attendance was already taken for Student {form.matricNo.data.upper()}", "info")
-            if not valid_matric:
-                flash(f"Unable to take attendance for Student {form.matricNo.data.upper()}", "danger")
+            matric_no = form.matricNo.data.upper()
+            attend = roster.get(matric_no)
+            if attend is None:
+                flash(f"Unable to take attendance for Student {matric_no}", "danger")
+            elif statuses.get(attend.attendance_id) != "Present":
+                send_manual_attendance_email(attend.attendance_id, matric_no, roster.lab_tech_email)
+                flash('Email has been sent to the lab technician. Please inform them', 'success')
+            else:
+                flash(f'Your attendance, {matric_no}, has already been marked', 'info')
             form.matricNo.data = ""
+        attendances = [{'seatNo': attend.seat_no, 'name': attend.name, 'attendance': statuses.get(attend.attendance_id)}
+                       for (_, attend) in roster.sheet()]
         return render_template('take_attendance.html', attendances=attendances,
-                               date=attendances[0].indexDate.date, class_name=attendances[0].indexDate.index.className,
-                               class_date_id=class_date_id, form=form, room_no=room_no)
+                               date=roster.date, class_name=roster.class_name,
+                               class_date_id=class_date_id, form=form, room_no=roster.room)
     else:
         flash('The attendance taking for this class has not started', 'warning')
         return redirect(url_for('error'))
@@ -900,7 +986,73 @@ def error():
 
 @app.route('/take_photo/<int:class_date_id>')
 def take_photo(class_date_id):
-    return render_template('take_photo.html', class_date_id=class_date_id)
+    return render_template('take_photo.html', class_date_id=class_date_id, capture=capture_settings())
+
+
+def capture_settings():
+    # how kiosks should encode their captures: at most max_width pixels wide,
+    # at the given JPEG quality, keeping the centered crop fraction of the
+    # frame where the student's face is expected
+    return {'max_width': app.config['RECOGNITION_CAPTURE_MAX_WIDTH'],
+            'jpeg_quality': app.config['RECOGNITION_CAPTURE_JPEG_QUALITY'],
+            'crop': app.config['RECOGNITION_CAPTURE_CROP']}
+
+
+@app.route('/recognition_capture_settings')
+def recognition_capture_settings():
+    return jsonify(capture_settings())
+
+
+def get_class_matric_nos(class_date_id):
+    roster = get_roster(class_date_id)
+    return roster.matric_nos if roster else []
+
+
+def recognizer():
+    # the recognition service when one is configured, so that web workers do
+    # not load the models themselves, otherwise the models of this process
+    if app.config['RECOGNITION_SERVICE']:
+        return get_client(app.config['RECOGNITION_SERVICE'], timeout=app.config['RECOGNITION_SERVICE_TIMEOUT'])
+
+    # every web request is matched against the students of its class (see
+    # recognize_in_class), never by the SVC or IVF matchers over the whole
+    # gallery, which are only chosen on the command line
+    from facial_recognition.service import get_recognizer
+    return get_recognizer(
+        streams=dict(detect_every=app.config['RECOGNITION_STREAM_DETECT_EVERY'],
+                     skip_distance=app.config['RECOGNITION_STREAM_SKIP_DISTANCE'],
+                     session_ttl=app.config['RECOGNITION_STREAM_TTL']),
+        detector=app.config['RECOGNITION_DETECTOR'], embedding_model=app.config['RECOGNITION_EMBEDDING_MODEL'],
+        backend=app.config['RECOGNITION_DNN_BACKEND'], target=app.config['RECOGNITION_DNN_TARGET'],
+        matcher='cosine', batching=app.config['RECOGNITION_BATCHING'],
+        max_batch=app.config['RECOGNITION_MAX_BATCH'], max_wait=app.config['RECOGNITION_MAX_WAIT_MS'] / 1000,
+        pool_size=app.config['RECOGNITION_POOL_SIZE'], threads=app.config['RECOGNITION_THREADS'],
+        result_cache_size=app.config['RECOGNITION_RESULT_CACHE_SIZE'],
+        result_cache_ttl=app.config['RECOGNITION_RESULT_CACHE_TTL'],
+        duplicate_distance=app.config['RECOGNITION_DUPLICATE_DISTANCE'], quality=quality_thresholds())
+
+
+@app.errorhandler(RecognitionServiceError)
+def recognition_service_error(e):
+    return jsonify(error=f"Face recognition is unavailable: {e}"), 503
+
+
+def quality_thresholds():
+    if not app.config['RECOGNITION_QUALITY_GATE']:
+        return None
+    return dict(min_sharpness=app.config['RECOGNITION_MIN_SHARPNESS'],
+                min_brightness=app.config['RECOGNITION_MIN_BRIGHTNESS'],
+                max_brightness=app.config['RECOGNITION_MAX_BRIGHTNESS'],
+                min_size=app.config['RECOGNITION_MIN_FACE_SIZE'],
+                min_confidence=app.config['RECOGNITION_MIN_FACE_CONFIDENCE'])
+
+
+def recognize_in_class(class_date_id, data, group=False, matric_nos=None):
+    # only the students enrolled in this class date are considered as matches;
+    # data is the encoded capture, ValueError is raised when it is unreadable
+    if matric_nos is None:
+        matric_nos = get_class_matric_nos(class_date_id)
+    return recognizer().recognize(data, key=class_date_id, names=matric_nos, group=group)
 
 
 @app.route('/facial_recognition/<int:class_date_id>')
@@ -908,37 +1060,241 @@ def facial_recognition(class_date_id):
     photo_base64 = request.args.get('photo_cap')
     header, encoded = photo_base64.split(",", 1)
     binary_data = base64.b64decode(encoded)
-    image_name = "photo.jpg"
-
-    with open(f"facial_recognition/image/{image_name}", "wb") as f:
-        # with open(os.path.join("D:\\Python Projects\\flask-project\\frats\\facial_recognition\\image",
-        #                        image_name), "wb") as f:
-        f.write(binary_data)
 
-    result = recognize.recognize_image()
+    result = recognize_in_class(class_date_id, binary_data)
     print(result)
 
-    return jsonify(result=result, class_date_id=class_date_id)
+    return jsonify(result=result["name"], class_date_id=class_date_id)
+
+
+def read_capture():
+    # webcam.js posts the capture as a multipart Blob named 'webcam', other
+    # clients may post the raw image/jpeg body; either way it is read from the
+    # request stream in chunks rather than parsed out of the query string
+    upload = request.files.get('webcam') or request.files.get('photo')
+    stream = upload.stream if upload else request.stream
+    data = bytearray()
+    chunk = stream.read(64 * 1024)
+    while chunk:
+        data += chunk
+        chunk = stream.read(64 * 1024)
+    return data
+
+
+@app.route('/facial_recognition_upload/<int:class_date_id>', methods=['POST'])
+def facial_recognition_upload(class_date_id):
+    try:
+        result = recognize_in_class(class_date_id, read_capture())
+    except ValueError:
+        return jsonify(error="Unable to read the uploaded image", class_date_id=class_date_id), 400
+
+    # a capture rejected by the quality gate comes with the reason, for the
+    # kiosk to ask for a retake
+    return jsonify(result=result["name"], class_date_id=class_date_id, rejected=result.get('rejected'),
+                   message=result.get('message'))
+
+
+def recognition_jobs():
+    return get_job_queue(workers=app.config['RECOGNITION_JOB_WORKERS'],
+                         max_pending=app.config['RECOGNITION_MAX_PENDING_JOBS'],
+                         job_dir=app.config['RECOGNITION_JOB_DIR'])
+
+
+def recognize_capture(data, class_date_id, matric_nos):
+    # runs on the recognition job pool, outside of any request (so the class
+    # roster is looked up by the request that submits the job)
+    result = recognize_in_class(class_date_id, data, matric_nos=matric_nos)
+    return {'name': result['name'], 'rejected': result.get('rejected'), 'message': result.get('message')}
+
+
+@app.route('/facial_recognition_jobs/<int:class_date_id>', methods=['POST'])
+def submit_facial_recognition_job(class_date_id):
+    # decoding and recognition happen on the job pool; this request only
+    # reads the capture and returns a job id to poll
+    data = read_capture()
+    try:
+        job_id = recognition_jobs().submit(recognize_capture, bytes(data), class_date_id,
+                                           get_class_matric_nos(class_date_id))
+    except QueueFull:
+        response = jsonify(error="The server is busy, please try again", class_date_id=class_date_id)
+        response.headers['Retry-After'] = '1'
+        return response, 429
+    return jsonify(job_id=job_id, class_date_id=class_date_id,
+                   status_url=url_for('facial_recognition_job', job_id=job_id)), 202
+
+
+@app.route('/facial_recognition_job/<string:job_id>')
+def facial_recognition_job(job_id):
+    # ?wait=<seconds> holds the request until the job finishes (long polling),
+    # which only applies to the worker that accepted the job and ties up a
+    # sync worker meanwhile, so the kiosk polls with wait=0
+    wait = min(request.args.get('wait', 0, type=float), 10.0)
+    job = recognition_jobs().get(job_id, wait=wait)
+    if job is None:
+        return jsonify(error="Unknown or expired job"), 404
+    result = job['result'] or {}
+    return jsonify(job_id=job_id, status=job['status'], result=result.get('name'), rejected=result.get('rejected'),
+                   message=result.get('message'), error=job['error'])
+
+
+@app.route('/recognition_metrics')
+@login_required
+def recognition_metrics():
+    if current_user.role != 'admin':
+        return jsonify(error='You are not authorized to perform this action'), 403
+    writer = attendance_writer()
+    return jsonify(dict(recognizer().stats(), attendance_writer=writer.stats() if writer else None))
+
+
+@app.route('/take_group_photo/<int:class_date_id>')
+@login_required
+def take_group_photo(class_date_id):
+    if current_user.role != 'staff':
+        flash('You are not authorized to perform this action', 'danger')
+        return redirect(url_for('dashboard'))
+
+    class_date = IndexDates.query.get(class_date_id)
+    if not class_date.attendance_started:
+        flash('The attendance taking for this class has not started', 'warning')
+        return redirect(url_for('view_attendance', class_date_id=class_date_id))
+
+    dashboard_data = get_dashboard()
+    return render_template('take_group_photo.html', dashboard_data=dashboard_data, class_date_id=class_date_id,
+                           date=class_date.date, class_name=class_date.index.className)
+
+
+@app.route('/group_recognition/<int:class_date_id>', methods=['POST'])
+@login_required
+def group_recognition(class_date_id):
+    if current_user.role != 'staff':
+        return jsonify(error='You are not authorized to perform this action'), 403
+
+    roster = get_roster(class_date_id)
+    if roster is None:
+        return jsonify(error="Unknown class", class_date_id=class_date_id), 404
+
+    try:
+        faces = recognize_in_class(class_date_id, read_capture(), group=True, matric_nos=roster.matric_nos)
+    except ValueError:
+        return jsonify(error="Unable to read the uploaded image", class_date_id=class_date_id), 400
+
+    # only the students enrolled in this class can be marked present
+    enrolled = roster.names(face['name'] for face in faces)
+    for face in faces:
+        face['student_name'] = enrolled.get(face['name'])
+
+    return jsonify(faces=faces, class_date_id=class_date_id)
+
+
+@app.route('/group_recognition_attendance/<int:class_date_id>', methods=['POST'])
+@login_required
+def group_recognition_attendance(class_date_id):
+    if current_user.role != 'staff':
+        flash('You are not authorized to perform this action', 'danger')
+        return redirect(url_for('dashboard'))
+
+    class_date = IndexDates.query.get(class_date_id)
+    if not class_date.attendance_started:
+        flash('The attendance taking for this class has not started', 'warning')
+        return redirect(url_for('view_attendance', class_date_id=class_date_id))
+
+    marked = mark_present(class_date_id, request.form.getlist('matricNo'))
+    flash(f'Attendance has been taken for {len(marked)} student(s)', 'success')
+    return redirect(url_for('view_attendance', class_date_id=class_date_id))
+
+
+def mark_present(class_date_id, matric_nos):
+    # mark every given student of the class present (see record_present) and
+    # return the matric numbers that were not marked yet
+    roster = get_roster(class_date_id)
+    ids = {roster.get(matric_no).attendance_id: matric_no for matric_no in set(matric_nos) if matric_no in roster}
+    if not ids:
+        return []
+    statuses = current_statuses(class_date_id, list(ids))
+    absent = [attendance_id for attendance_id in ids if statuses.get(attendance_id) != 'Present']
+    record_present(absent)
+    return [ids[attendance_id] for attendance_id in absent]
+
+
+@app.route('/stream_attendance/<int:class_date_id>')
+@login_required
+def stream_attendance(class_date_id):
+    if current_user.role != 'staff':
+        flash('You are not authorized to perform this action', 'danger')
+        return redirect(url_for('dashboard'))
+
+    class_date = IndexDates.query.get(class_date_id)
+    if not class_date.attendance_started:
+        flash('The attendance taking for this class has not started', 'warning')
+        return redirect(url_for('view_attendance', class_date_id=class_date_id))
+
+    dashboard_data = get_dashboard()
+    return render_template('stream_attendance.html', dashboard_data=dashboard_data, class_date_id=class_date_id,
+                           date=class_date.date, class_name=class_date.index.className)
+
+
+@app.route('/attendance_stream/<int:class_date_id>', methods=['POST'])
+@login_required
+def open_attendance_stream(class_date_id):
+    if current_user.role != 'staff':
+        return jsonify(error='You are not authorized to perform this action'), 403
+    if not attendance_started(class_date_id):
+        return jsonify(error='The attendance taking for this class has not started'), 409
+
+    session_id = recognizer().stream_open(class_date_id, get_class_matric_nos(class_date_id))
+    return jsonify(session_id=session_id, class_date_id=class_date_id,
+                   frame_url=url_for('attendance_stream_frame', class_date_id=class_date_id, session_id=session_id),
+                   close_url=url_for('close_attendance_stream', session_id=session_id))
+
+
+@app.route('/attendance_stream_frame/<int:class_date_id>/<string:session_id>', methods=['POST'])
+@login_required
+def attendance_stream_frame(class_date_id, session_id):
+    # one (low resolution) frame of the stream; every student recognized in a
+    # new track, or in a track that was unknown so far, is marked present
+    # straight away
+    if not attendance_started(class_date_id):
+        recognizer().stream_close(session_id)
+        return jsonify(error='The attendance taking for this class has not started'), 409
+
+    # under a multi-worker server without a recognition service, the frame
+    # may reach a worker that did not open the stream, which then continues
+    # it under the same id (a student seen by two workers is marked once)
+    try:
+        frame = recognizer().stream_frame(session_id, read_capture(), key=class_date_id,
+                                          names=get_class_matric_nos(class_date_id))
+    except ValueError:
+        return jsonify(error="Unable to read the uploaded frame"), 400
+    if frame is None:
+        return jsonify(error="Unknown or expired stream"), 404
+
+    faces = frame['faces']
+    marked = mark_present(class_date_id, [face['name'] for face in faces if face['name'] != 'unknown'])
+    students = get_roster(class_date_id).names(marked)
+    return jsonify(faces=faces, marked=[{'matricNo': matric_no, 'name': students.get(matric_no)}
+                                        for matric_no in marked],
+                   tracks=frame['tracks'], class_date_id=class_date_id)
+
+
+@app.route('/attendance_stream_close/<string:session_id>', methods=['POST'])
+@login_required
+def close_attendance_stream(session_id):
+    recognizer().stream_close(session_id)
+    return jsonify(closed=session_id)
 
 
 @app.route('/facial_recognition_attendance/<int:class_date_id>/<string:matricNo>')
 def facial_recognition_attendance(class_date_id, matricNo):
-    attendances = Attendance.query.filter_by(indexDateId=class_date_id).all()
+    roster = get_roster(class_date_id)
 
-    attendance_started = attendances[0].indexDate.attendance_started
-    taken = False
-    if attendance_started:
-        for attend in attendances:
-            if attend.student.matricNo == matricNo:
-                taken = True
-                if attend.attendance != "Present":
-                    attend.attendance = "Present"
-                    db.session.commit()
-                    flash(f"Attendance has been taken for Student {matricNo}", "success")
-                else:
-                    flash(f"Attendance was already taken for Student {matricNo}", "info")
-        if not taken:
+    if roster and attendance_started(class_date_id):
+        attend = roster.get(matricNo)
+        if attend is None:
             flash(f"Unable to take attendance for Student {matricNo}", "danger")
+        elif mark_present(class_date_id, [matricNo]):
+            flash(f"Attendance has been taken for Student {matricNo}", "success")
+        else:
+            flash(f"Attendance was already taken for Student {matricNo}", "info")
         return redirect(url_for('take_attendance', class_date_id=class_date_id))
     else:
         flash('The attendance taking for this class has not started', 'warning')
@@ -0,0 +1,209 @@
+from contextlib import nullcontext
+from flask import has_app_context
+import threading
+import fcntl
+import atexit
+import time
+import glob
+import os
+
+from models import app, db
+from roster import mark_attendance
+
+
+JOURNAL_DIR = 'attendance_journal'
+FLUSH_INTERVAL = 0.2    # seconds
+FLUSH_BATCH = 100       # marks
+
+
+def _app_context():
+    # the writer thread needs an app context for the database session, while
+    # requests flushing (e.g. stop_attendance) use their own
+    return nullcontext() if has_app_context() else app.app_context()
+
+
+class AttendanceWriter:
+    """Acknowledges attendance marks as soon as they are appended to a local
+    journal and writes them to the database in batched transactions, every
+    flush_interval seconds or every flush_batch marks, so that a lecture rush
+    costs a few commits instead of one SQLite commit per student.
+
+    Every process appends to its own journal and holds a lock on it; journals
+    left behind by a crashed process are replayed when the next writer starts.
+    Marks are idempotent, so a journal is only truncated once every mark in it
+    has been committed."""
+
+    def __init__(self, journal_dir=JOURNAL_DIR, flush_interval=FLUSH_INTERVAL, flush_batch=FLUSH_BATCH, fsync=False):
+        self.journal_dir = journal_dir
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}
+        self._flushing = set()
+
+        self._marks = 0
+        self._flushes = 0
+        self._errors = 0
+        self._last_error = None
+        self._flush_times = []
+        self._batch_sizes = []
+        self._delays = []
+
+        os.makedirs(journal_dir, exist_ok=True)
+        self.replayed = self._replay()
+        self._journal = self._open_journal(os.path.join(journal_dir, f"marks.{os.getpid()}.log"))
+
+        threading.Thread(target=self._run, name="attendance-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _is_current(journal, path):
+        # whether the locked file is still the one at path, i.e. it was not
+        # replayed and removed by another process between open() and flock()
+        try:
+            return os.fstat(journal.fileno()).st_ino == os.stat(path).st_ino
+        except OSError:
+            return False
+
+    def _open_journal(self, path):
+        # a process starting at the same moment may replay and remove the new,
+        # still unlocked file; marks appended to it would then be lost
+        while True:
+            journal = open(path, "a")
+            fcntl.flock(journal, fcntl.LOCK_EX)
+            if self._is_current(journal, path):
+                return journal
+            journal.close()
+
+    def _replay(self):
+        # commit the marks of journals that no live process holds a lock on
+        replayed = 0
+        for path in glob.glob(os.path.join(self.journal_dir, "marks.*.log")):
+            try:
+                journal = open(path, "r+")
+            except OSError:
+                continue
+            with journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                if not self._is_current(journal, path):
+                    continue
+                ids = {int(line) for line in journal.read().split() if line.isdigit()}
+                if ids:
+                    with _app_context():
+                        mark_attendance(list(ids))
+                    replayed += len(ids)
+                os.remove(path)
+        if replayed:
+            print("[INFO] replayed {} attendance mark(s) from the journal...".format(replayed))
+        return replayed
+
+    def mark(self, attendance_ids):
+        # journal the marks and return straight away; they are committed by
+        # the next flush
+        with self._lock:
+            new = [attendance_id for attendance_id in attendance_ids
+                   if attendance_id not in self._pending and attendance_id not in self._flushing]
+            if not new:
+                return
+            self._journal.write("".join(f"{attendance_id}\n" for attendance_id in new))
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            now = time.monotonic()
+            for attendance_id in new:
+                self._pending[attendance_id] = now
+            self._marks += len(new)
+            if len(self._pending) >= self.flush_batch:
+                self._wake.set()
+
+    def pending(self, attendance_ids):
+        # the given attendances that are marked but not committed yet
+        with self._lock:
+            return {attendance_id for attendance_id in attendance_ids
+                    if attendance_id in self._pending or attendance_id in self._flushing}
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # flush() keeps failed marks pending; whatever else went wrong
+                # must not stop the thread
+                print("[WARNING] unable to flush the attendance marks: {}".format(e))
+
+    def flush(self):
+        # commit every pending mark in one transaction
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                (batch, self._pending) = (self._pending, {})
+                self._flushing = set(batch)
+
+            started = time.monotonic()
+            try:
+                with _app_context():
+                    try:
+                        mark_attendance(list(batch))
+                    except Exception:
+                        db.session.rollback()
+                        raise
+            except Exception as e:
+                # keep the marks (they are still journaled) for the next flush
+                with self._lock:
+                    batch.update(self._pending)
+                    self._pending = batch
+                    self._flushing = set()
+                    self._errors += 1
+                    self._last_error = str(e)
+                return
+            finished = time.monotonic()
+
+            with self._lock:
+                self._flushing = set()
+                self._flushes += 1
+                self._last_error = None
+                self._flush_times = (self._flush_times + [finished - started])[-1000:]
+                self._batch_sizes = (self._batch_sizes + [len(batch)])[-1000:]
+                self._delays = (self._delays + [finished - marked for marked in batch.values()])[-1000:]
+                if not self._pending:
+                    self._journal.truncate(0)
+
+    def stats(self):
+        def summary(values, scale=1000):
+            if not values:
+                return None
+            values = sorted(values)
+            return {"mean": round(sum(values) / len(values) * scale, 2),
+                    "p95": round(values[int(len(values) * 0.95)] * scale, 2),
+                    "max": round(values[-1] * scale, 2)}
+
+        with self._lock:
+            return {"marks": self._marks, "pending": len(self._pending) + len(self._flushing),
+                    "flushes": self._flushes, "errors": self._errors, "last_error": self._last_error,
+                    "replayed": self.replayed, "flush_ms": summary(self._flush_times),
+                    "batch_size": summary(self._batch_sizes, scale=1),
+                    "mark_to_commit_ms": summary(self._delays)}
+
+
+_attendance_writer = None
+_attendance_writer_lock = threading.Lock()
+
+
+def get_attendance_writer(**config):
+    # one writer (and journal) per process
+    global _attendance_writer
+    if _attendance_writer is None:
+        with _attendance_writer_lock:
+            if _attendance_writer is None:
+                _attendance_writer = AttendanceWriter(**config)
+    return _attendance_writer
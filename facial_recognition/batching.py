@@ -0,0 +1,122 @@
+# import the necessary packages
+import numpy as np
+import threading
+import queue
+import time
+
+MAX_BATCH = 16
+MAX_WAIT = 0.005
+
+
+class _Request:
+    def __init__(self, faces, candidates):
+        self.faces = faces
+        self.candidates = candidates
+        self.queued_at = time.monotonic()
+        self.done = threading.Event()
+        self.matches = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Queues the face crops of concurrent recognition requests and, after at
+    most max_wait seconds or once max_batch faces are waiting, runs them through
+    the embedder in one forward pass and the matcher in one call per gallery.
+
+    embed(faces) returns the 128-d vectors of a list of face crops and
+    match(vecs, candidates) the (name, score) of every vector."""
+
+    def __init__(self, embed, match, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self._embed = embed
+        self._match = match
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+
+        # metrics
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._faces = 0
+        self._largest_batch = 0
+        self._queue_wait = 0.0
+        self._longest_queue_wait = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="recognition-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, faces, candidates=None):
+        # block until the batch holding these faces has been processed
+        request = _Request(faces, candidates)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.matches
+
+    def _collect(self):
+        # wait for the first request, then keep collecting until the batch is
+        # full or the first request has waited max_wait
+        batch = [self._queue.get()]
+        size = len(batch[0].faces)
+        deadline = batch[0].queued_at + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.faces)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            try:
+                vecs = self._embed([face for request in batch for face in request.faces])
+
+                # requests matched against the same gallery (e.g. kiosks of the
+                # same class) share one matcher call
+                offsets = np.cumsum([0] + [len(request.faces) for request in batch])
+                groups = {}
+                for (i, request) in enumerate(batch):
+                    groups.setdefault(id(request.candidates), []).append(i)
+                for members in groups.values():
+                    rows = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in members])
+                    matches = self._match(vecs[rows], batch[members[0]].candidates)
+                    start = 0
+                    for i in members:
+                        count = len(batch[i].faces)
+                        batch[i].matches = matches[start:start + count]
+                        start += count
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+
+            self._record(batch, started)
+            for request in batch:
+                request.done.set()
+
+    def _record(self, batch, started):
+        with self._stats_lock:
+            size = sum(len(request.faces) for request in batch)
+            self._batches += 1
+            self._requests += len(batch)
+            self._faces += size
+            self._largest_batch = max(self._largest_batch, size)
+            for request in batch:
+                wait = started - request.queued_at
+                self._queue_wait += wait
+                self._longest_queue_wait = max(self._longest_queue_wait, wait)
+
+    def stats(self):
+        with self._stats_lock:
+            return {"batches": self._batches, "requests": self._requests, "faces": self._faces,
+                    "mean_batch_size": self._faces / self._batches if self._batches else 0.0,
+                    "largest_batch": self._largest_batch,
+                    "mean_queue_wait_ms": self._queue_wait / self._requests * 1000 if self._requests else 0.0,
+                    "longest_queue_wait_ms": self._longest_queue_wait * 1000}
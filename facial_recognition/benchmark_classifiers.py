@@ -0,0 +1,71 @@
+# USAGE
+# python -m facial_recognition.benchmark_classifiers --identities 100 1000 5000
+# python -m facial_recognition.benchmark_classifiers --embeddings facial_recognition/output/embeddings
+
+# import the necessary packages
+from facial_recognition.benchmark_matchers import synthetic_gallery
+from facial_recognition.embedding_store import load_embeddings
+from facial_recognition.train_facial_recognition_model import CLASSIFIERS, build_classifier
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelEncoder
+import numpy as np
+import argparse
+import pickle
+import time
+
+
+def benchmark(name, embeddings, labels, rng):
+    # fit time, pickled size and held-out top-1 accuracy of one classifier
+    (train_x, test_x, train_y, test_y) = train_test_split(embeddings, labels, test_size=0.25, stratify=labels,
+                                                          random_state=rng)
+    recognizer = build_classifier(name)
+    start = time.perf_counter()
+    recognizer.fit(train_x, train_y)
+    fit_time = time.perf_counter() - start
+    size = len(pickle.dumps(recognizer))
+    accuracy = np.mean(recognizer.classes_[recognizer.predict_proba(test_x).argmax(axis=1)] == test_y)
+    return fit_time, size, accuracy
+
+
+def main():
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--identities", type=int, nargs="+", default=[100, 1000, 5000],
+                    help="numbers of students of the synthetic datasets to benchmark")
+    ap.add_argument("-s", "--samples", type=int, default=8,
+                    help="number of embeddings per synthetic student")
+    ap.add_argument("-e", "--embeddings", default=None,
+                    help="benchmark on an embedding store (or pickle) instead of synthetic data")
+    ap.add_argument("-C", "--classifiers", nargs="+", default=list(CLASSIFIERS), choices=CLASSIFIERS,
+                    help="classifiers to benchmark")
+    ap.add_argument("--svc-max", type=int, default=1000,
+                    help="largest number of students the SVC is trained for (training grows super-linearly)")
+    args = vars(ap.parse_args())
+
+    rng = np.random.RandomState(42)
+    datasets = []
+    if args["embeddings"]:
+        (embeddings, names) = load_embeddings(args["embeddings"])
+        datasets.append((np.asarray(embeddings, dtype=np.float32), np.asarray(names)))
+    else:
+        for identities in args["identities"]:
+            (_, embeddings, names) = synthetic_gallery(identities, args["samples"], rng)
+            datasets.append((embeddings, names))
+
+    print("{:>10} {:>8} {:>8} {:>12} {:>10} {:>10}".format("identities", "samples", "model", "fit(s)",
+                                                           "size(MB)", "top-1"))
+    for (embeddings, names) in datasets:
+        labels = LabelEncoder().fit_transform(names)
+        identities = len(np.unique(labels))
+        for name in args["classifiers"]:
+            if name == "svc" and identities > args["svc_max"]:
+                print("{:>10} {:>8} {:>8} {:>12} {:>10} {:>10}".format(identities, len(labels), name,
+                                                                       "skipped", "-", "-"))
+                continue
+            (fit_time, size, accuracy) = benchmark(name, embeddings, labels, rng)
+            print("{:>10} {:>8} {:>8} {:>12.2f} {:>10.2f} {:>10.3f}".format(identities, len(labels), name,
+                                                                           fit_time, size / 1e6, accuracy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# USAGE
+# python -m facial_recognition.benchmark_matchers --identities 1000 10000 50000
+
+# import the necessary packages
+from facial_recognition.gallery import Gallery
+from facial_recognition.matchers import SVCMatcher, build_matcher
+from sklearn.preprocessing import LabelEncoder
+from sklearn.svm import SVC
+import numpy as np
+import argparse
+import pickle
+import time
+
+
+def synthetic_gallery(identities, samples, rng, dim=128, noise=0.15):
+    # every identity is a random unit vector and every sample of it a noisy
+    # copy, which is roughly how OpenFace embeddings of one student cluster
+    centers = rng.standard_normal((identities, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    embeddings = np.repeat(centers, samples, axis=0)
+    embeddings += noise * rng.standard_normal(embeddings.shape).astype(np.float32) / np.sqrt(dim)
+    names = np.repeat(np.array([f"U{i:07d}" for i in range(identities)]), samples)
+    return centers, embeddings, names
+
+
+def time_queries(matcher, queries):
+    # the per-query latency of matching a single face, as a kiosk does
+    start = time.perf_counter()
+    for q in queries:
+        matcher.match(q[np.newaxis])
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--identities", type=int, nargs="+", default=[1000, 10000, 50000],
+                    help="gallery sizes (number of students) to benchmark")
+    ap.add_argument("-s", "--samples", type=int, default=3,
+                    help="number of embeddings stored per student")
+    ap.add_argument("-q", "--queries", type=int, default=100,
+                    help="number of faces to match per gallery size")
+    ap.add_argument("--svc-max", type=int, default=1000,
+                    help="largest gallery the SVC is trained for (training grows super-linearly)")
+    args = vars(ap.parse_args())
+
+    rng = np.random.RandomState(42)
+    print("{:>10} {:>8} {:>12} {:>12} {:>10}".format("identities", "matcher", "latency(ms)", "memory(MB)", "top-1"))
+    for identities in args["identities"]:
+        (centers, embeddings, names) = synthetic_gallery(identities, args["samples"], rng)
+        picks = rng.choice(identities, args["queries"])
+        queries = centers[picks] + 0.15 * rng.standard_normal((len(picks), 128)).astype(np.float32) / np.sqrt(128)
+        expected = names[picks * args["samples"]]
+
+        gallery = Gallery(embeddings, names)
+        matchers = {name: build_matcher(name, gallery=gallery, min_similarity=-1.0) for name in ("cosine", "ivf")}
+        if identities <= args["svc_max"]:
+            le = LabelEncoder()
+            recognizer = SVC(C=1.0, kernel="linear", probability=True)
+            recognizer.fit(embeddings, le.fit_transform(names))
+            matchers["svc"] = SVCMatcher(recognizer, le)
+
+        for (name, matcher) in matchers.items():
+            latency = time_queries(matcher, queries)
+            if name == "svc":
+                memory = len(pickle.dumps(matcher.recognizer)) + len(pickle.dumps(matcher.le))
+            else:
+                memory = matcher.nbytes
+            accuracy = np.mean([m[0] == e for (m, e) in zip(matcher.match(queries), expected)])
+            print("{:>10} {:>8} {:>12.3f} {:>12.2f} {:>10.3f}".format(identities, name, latency,
+                                                                      memory / 1e6, accuracy))
+        if identities > args["svc_max"]:
+            print("{:>10} {:>8} {:>12} {:>12} {:>10}".format(identities, "svc", "skipped", "-", "-"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+# import the necessary packages
+import threading
+import socket
+import struct
+import json
+
+# every message is a fixed header holding the lengths of a JSON object and of
+# a binary payload (e.g. the encoded image), followed by both
+HEADER = struct.Struct(">II")
+MAX_MESSAGE = 32 * 1024 * 1024
+
+TIMEOUT = 10.0
+MAX_IDLE = 8
+
+
+class RecognitionServiceError(Exception):
+    """Raised when the recognition service cannot be reached or fails."""
+
+
+def parse_address(address):
+    # "unix:/path/to/socket" or "host:port"
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    (host, port) = address.rsplit(":", 1)
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def send_message(sock, fields, payload=b""):
+    header = json.dumps(fields).encode()
+    sock.sendall(HEADER.pack(len(header), len(payload)) + header)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("connection closed")
+        received += count
+    return buffer
+
+
+def recv_message(sock):
+    # the JSON fields and the payload of the next message
+    (header_size, payload_size) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    if header_size + payload_size > MAX_MESSAGE:
+        raise ConnectionError("message too large")
+    fields = json.loads(recv_exactly(sock, header_size).decode())
+    payload = recv_exactly(sock, payload_size) if payload_size else b""
+    return fields, payload
+
+
+class RecognitionClient:
+    """Calls a recognition service (see facial_recognition.service) over a
+    Unix or TCP socket. Connections are kept open and reused by later calls
+    from any thread; every call is bounded by timeout seconds.
+
+    Mirrors the methods of facial_recognition.service.Recognizer."""
+
+    def __init__(self, address, timeout=TIMEOUT, max_idle=MAX_IDLE):
+        (self.family, self.address) = parse_address(address)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def _connect(self):
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        if self.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _checkin(self, sock):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(sock)
+                return
+        sock.close()
+
+    def call(self, op, payload=b"", **fields):
+        # an idle connection may have been closed by a restarted service, in
+        # which case the call is retried once on a new connection
+        for attempt in range(2):
+            try:
+                (sock, reused) = self._checkout()
+            except OSError as e:
+                raise RecognitionServiceError(f"unable to connect to the recognition service: {e}") from e
+            try:
+                send_message(sock, dict(fields, op=op), payload)
+                (reply, _) = recv_message(sock)
+            except socket.timeout as e:
+                sock.close()
+                raise RecognitionServiceError("the recognition service timed out") from e
+            except (OSError, ValueError) as e:
+                sock.close()
+                if reused and attempt == 0:
+                    continue
+                raise RecognitionServiceError(f"lost the connection to the recognition service: {e}") from e
+            self._checkin(sock)
+            break
+
+        if "error" in reply:
+            # an unreadable image is reported like a local decoding failure
+            if reply.get("type") == "ValueError":
+                raise ValueError(reply["error"])
+            raise RecognitionServiceError(reply["error"])
+        return reply["result"]
+
+    def recognize(self, data, key=None, names=None, group=False):
+        return self.call("recognize", bytes(data), key=key, names=names, group=group)
+
+    def warm(self, key, names):
+        return self.call("warm", key=key, names=names)
+
+    def evict(self, key):
+        return self.call("evict", key=key)
+
+    def stream_open(self, key, names=None):
+        return self.call("stream_open", key=key, names=names)
+
+    def stream_frame(self, session_id, data, key=None, names=None):
+        return self.call("stream_frame", bytes(data), session_id=session_id, key=key, names=names)
+
+    def stream_close(self, session_id):
+        return self.call("stream_close", session_id=session_id)
+
+    def stats(self):
+        return self.call("stats")
+
+    def close(self):
+        with self._lock:
+            (idle, self._idle) = (self._idle, [])
+        for sock in idle:
+            sock.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(address, **config):
+    # one client (and pool of connections) per service address and process
+    with _clients_lock:
+        if address not in _clients:
+            _clients[address] = RecognitionClient(address, **config)
+        return _clients[address]
@@ -0,0 +1,107 @@
+# USAGE
+# python -m facial_recognition.compare_models --dataset facial_recognition/dataset \
+#	--candidate-detector facial_recognition/face_detection_model/res10_int8.onnx --backend auto
+
+# import the necessary packages
+from facial_recognition.nets import FaceNets, BACKENDS, TARGETS, DETECTOR, EMBEDDING_MODEL, CONFIDENCE, \
+    fastest_config, read_image
+from facial_recognition.gallery import normalize
+from facial_recognition.tracking import iou
+from imutils import paths
+import numpy as np
+import argparse
+import time
+import os
+
+
+def run(nets, images, confidence):
+    # the largest face (box and normalized embedding) of every image, or None,
+    # and the mean time per image
+    results = []
+    started = time.perf_counter()
+    for image in images:
+        face = nets.embed_largest_face(image, confidence)
+        if face is not None:
+            face = {"box": face["box"], "vec": normalize(face["vec"].reshape(1, -1))[0]}
+        results.append(face)
+    return results, (time.perf_counter() - started) / len(images)
+
+
+def nearest_neighbour_accuracy(results, names):
+    # leave-one-out top-1 accuracy of matching every embedding against the
+    # embeddings of the other images
+    found = [i for (i, r) in enumerate(results) if r is not None]
+    if len(found) < 2:
+        return 0.0
+    vecs = np.stack([results[i]["vec"] for i in found])
+    labels = np.array([names[i] for i in found])
+    similarities = vecs @ vecs.T
+    np.fill_diagonal(similarities, -np.inf)
+    return float(np.mean(labels[similarities.argmax(axis=1)] == labels))
+
+
+def main():
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-i", "--dataset", default=os.path.join('facial_recognition', 'dataset'),
+                    help="path to input directory of faces + images")
+    ap.add_argument("-d", "--detector", default=DETECTOR,
+                    help="reference face detector")
+    ap.add_argument("-m", "--embedding-model", default=EMBEDDING_MODEL,
+                    help="reference face embedding model")
+    ap.add_argument("--candidate-detector", default=None,
+                    help="face detector to compare (e.g. a quantized .onnx export; default: the reference)")
+    ap.add_argument("--candidate-embedding-model", default=None,
+                    help="face embedding model to compare (default: the reference)")
+    ap.add_argument("-b", "--backend", default="default", choices=list(BACKENDS) + ["auto"],
+                    help="cv2.dnn backend of the candidate (auto picks the fastest)")
+    ap.add_argument("-t", "--target", default="cpu", choices=TARGETS,
+                    help="cv2.dnn target of the candidate")
+    ap.add_argument("-c", "--confidence", type=float, default=CONFIDENCE,
+                    help="minimum probability to filter weak detections")
+    ap.add_argument("-n", "--limit", type=int, default=0,
+                    help="compare at most this many images (0 for all)")
+    args = vars(ap.parse_args())
+
+    candidate_detector = args["candidate_detector"] or args["detector"]
+    candidate_embedding_model = args["candidate_embedding_model"] or args["embedding_model"]
+    (backend, target) = (args["backend"], args["target"])
+    if backend == "auto":
+        (backend, target) = fastest_config(candidate_detector, candidate_embedding_model)
+
+    image_paths = sorted(paths.list_images(args["dataset"]))
+    if args["limit"]:
+        image_paths = image_paths[:args["limit"]]
+    images = [read_image(image_path) for image_path in image_paths]
+    (image_paths, images) = zip(*[(p, image) for (p, image) in zip(image_paths, images) if image is not None])
+    names = [image_path.split(os.path.sep)[-2] for image_path in image_paths]
+    print("[INFO] comparing on {} image(s)...".format(len(images)))
+
+    reference = FaceNets(args["detector"], args["embedding_model"])
+    candidate = FaceNets(candidate_detector, candidate_embedding_model, backend, target)
+    (expected, reference_time) = run(reference, images, args["confidence"])
+    (actual, candidate_time) = run(candidate, images, args["confidence"])
+
+    # drift of the candidate against the reference on the same images
+    both = [(e, a) for (e, a) in zip(expected, actual) if e is not None and a is not None]
+    missed = sum(1 for (e, a) in zip(expected, actual) if e is not None and a is None)
+    extra = sum(1 for (e, a) in zip(expected, actual) if e is None and a is not None)
+    overlaps = [iou(e["box"], a["box"]) for (e, a) in both]
+    similarities = [float(np.dot(e["vec"], a["vec"])) for (e, a) in both]
+
+    print("{:>10} {:>14} {:>12} {:>10}".format("models", "latency(ms)", "faces", "top-1"))
+    for (label, results, latency) in (("reference", expected, reference_time),
+                                      ("candidate", actual, candidate_time)):
+        print("{:>10} {:>14.2f} {:>12} {:>10.3f}".format(
+            label, latency * 1000, sum(1 for r in results if r is not None),
+            nearest_neighbour_accuracy(results, names)))
+    print("[INFO] candidate: {}/{} on {}/{}".format(candidate_detector, candidate_embedding_model, backend, target))
+    print("[INFO] faces missed: {}, extra faces: {}".format(missed, extra))
+    if both:
+        print("[INFO] box IoU: mean {:.3f}, min {:.3f}".format(np.mean(overlaps), np.min(overlaps)))
+        print("[INFO] embedding cosine similarity: mean {:.4f}, min {:.4f}".format(
+            np.mean(similarities), np.min(similarities)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# import the necessary packages
+import hashlib
+import pickle
+import os
+
+CACHE = os.path.join('facial_recognition', 'output', 'embedding_cache.pickle')
+
+
+def file_digest(path):
+    # hash the content of a file, so that a renamed or re-copied image is
+    # still recognised as the same image
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_version(*paths, **settings):
+    # identifies the networks (and the settings such as the detector
+    # confidence) that produced the cached embeddings
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(file_digest(path).encode())
+    for key in sorted(settings):
+        digest.update(f"{key}={settings[key]}".encode())
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """Detection box and 128-d embedding of every dataset image, keyed by the
+    hash of the image content. Images without a usable face are cached too
+    (as None) so that they are not run through the networks again."""
+
+    def __init__(self, path=CACHE, version=None):
+        self.path = path
+        self.version = version
+        self.entries = {}
+
+        # a cache written by other networks or settings is discarded
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = pickle.loads(f.read())
+            if data.get("version") == version:
+                self.entries = data["entries"]
+
+    def __contains__(self, digest):
+        return digest in self.entries
+
+    def get(self, digest):
+        return self.entries[digest]
+
+    def put(self, digest, entry):
+        self.entries[digest] = entry
+
+    def prune(self, digests):
+        # drop the entries of images that are no longer in the dataset
+        digests = set(digests)
+        removed = [digest for digest in self.entries if digest not in digests]
+        for digest in removed:
+            del self.entries[digest]
+        return len(removed)
+
+    def save(self):
+        # write to a temporary file first and swap it in, so that an
+        # interrupted run never leaves a corrupt cache behind
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pickle.dumps({"version": self.version, "entries": self.entries}))
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,151 @@
+# USAGE (convert a legacy embeddings.pickle)
+# python -m facial_recognition.embedding_store --input facial_recognition/output/embeddings.pickle \
+#	--output facial_recognition/output/embeddings --dtype float32
+
+# import the necessary packages
+from contextlib import contextmanager
+import numpy as np
+import threading
+import argparse
+import pickle
+import fcntl
+import json
+import glob
+import os
+
+# the store is a directory holding a small json header and two .npy files:
+# the (N, 128) matrix of L2-normalized embeddings and the N names
+STORE = os.path.join('facial_recognition', 'output', 'embeddings')
+HEADER = "header.json"
+FORMAT = "frats-embeddings"
+VERSION = 1
+DTYPES = ("float32", "float16")
+
+# the length of an OpenFace embedding
+EMBEDDING_SIZE = 128
+
+
+# the stores locked by the current thread, so that store_lock() can be nested
+_held = threading.local()
+
+
+def is_store(path):
+    return os.path.isdir(path)
+
+
+def modified_time(path):
+    # the header is replaced last when a store is written, so its mtime marks
+    # the moment the new embeddings became visible
+    return os.stat(os.path.join(path, HEADER) if is_store(path) else path).st_mtime
+
+
+@contextmanager
+def store_lock(path=STORE):
+    # serializes the processes (and threads) that read, modify and write a
+    # store, e.g. two enrollments or an enrollment and a retrain, through a
+    # lock file next to it; readers that only load the store never wait
+    path = os.path.abspath(path)
+    held = getattr(_held, "paths", None)
+    if held is None:
+        held = _held.paths = set()
+    if path in held:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        held.add(path)
+        try:
+            yield
+        finally:
+            held.discard(path)
+
+
+def read_header(path):
+    with open(os.path.join(path, HEADER)) as f:
+        header = json.load(f)
+    if header.get("format") != FORMAT or header.get("version") != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} embedding store")
+    return header
+
+
+def save_store(path, embeddings, names, dtype=None):
+    # every save writes a new generation of the .npy files and then swaps in
+    # a header pointing at them, so readers (including processes that have
+    # the previous generation memory-mapped) never see a half written store;
+    # the precision of an existing store is kept unless a dtype is given
+    os.makedirs(path, exist_ok=True)
+    try:
+        previous = read_header(path)
+    except (OSError, ValueError):
+        previous = {"generation": 0, "dtype": "float32"}
+    generation = previous["generation"] + 1
+    dtype = dtype or previous["dtype"]
+    if dtype not in DTYPES:
+        raise ValueError(f"unsupported dtype '{dtype}', expected one of {', '.join(DTYPES)}")
+
+    vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(names), EMBEDDING_SIZE)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = (vectors / norms).astype(dtype)
+    names = np.asarray(names, dtype=str)
+
+    header = {"format": FORMAT, "version": VERSION, "generation": generation, "dtype": dtype,
+              "count": int(vectors.shape[0]), "dim": EMBEDDING_SIZE,
+              "vectors": f"vectors.{generation}.npy", "names": f"names.{generation}.npy"}
+    np.save(os.path.join(path, header["vectors"]), vectors)
+    np.save(os.path.join(path, header["names"]), names)
+    tmp_path = os.path.join(path, HEADER + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(header, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, HEADER))
+
+    # drop the older generations; processes that still map them keep their
+    # pages until they reload
+    for old_path in glob.glob(os.path.join(path, "*.npy")):
+        if os.path.basename(old_path) not in (header["vectors"], header["names"]):
+            os.remove(old_path)
+    return header
+
+
+def load_store(path, mmap=True):
+    # with mmap the matrix is paged in from the OS page cache on demand and
+    # shared between every process that maps the same file
+    header = read_header(path)
+    mmap_mode = "r" if mmap else None
+    vectors = np.load(os.path.join(path, header["vectors"]), mmap_mode=mmap_mode)
+    names = np.load(os.path.join(path, header["names"]), mmap_mode=mmap_mode)
+    if len(vectors) != header["count"] or len(names) != header["count"]:
+        raise ValueError(f"{path} is inconsistent with its header")
+    return vectors, names, header
+
+
+def load_embeddings(path, mmap=True):
+    # read either an embedding store or a legacy embeddings.pickle
+    if is_store(path):
+        (vectors, names, _) = load_store(path, mmap)
+        return vectors, names
+    with open(path, "rb") as f:
+        data = pickle.loads(f.read())
+    return data["embeddings"], data["names"]
+
+
+def main():
+    # convert a legacy embeddings.pickle into an embedding store
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-i", "--input", default=os.path.join('facial_recognition', 'output', 'embeddings.pickle'),
+                    help="path to the serialized db of facial embeddings to convert")
+    ap.add_argument("-o", "--output", default=STORE,
+                    help="path to the output embedding store directory")
+    ap.add_argument("-t", "--dtype", default="float32", choices=DTYPES,
+                    help="precision of the stored embeddings")
+    args = vars(ap.parse_args())
+
+    print("[INFO] loading face embeddings...")
+    (embeddings, names) = load_embeddings(args["input"])
+    header = save_store(args["output"], embeddings, names, args["dtype"])
+    print("[INFO] wrote {} {} encodings to {}".format(header["count"], header["dtype"], args["output"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+# import the necessary packages
+from facial_recognition.batching import MicroBatcher, MAX_BATCH, MAX_WAIT
+from facial_recognition.embedding_store import modified_time, store_lock
+from facial_recognition.gallery import Gallery, EMBEDDINGS, MIN_SIMILARITY, normalize
+from facial_recognition.matchers import CosineMatcher, build_matcher
+from facial_recognition.model_registry import REGISTRY, current_version, load_version
+from facial_recognition.quality import QualityGate
+from facial_recognition.nets import NetPool, DETECTOR, EMBEDDING_MODEL, CONFIDENCE, decode_image, read_image, \
+    fastest_config
+from facial_recognition.result_cache import ResultCache, dhash, TTL, MAX_DISTANCE
+import numpy as np
+import threading
+import pickle
+import time
+import os
+
+# default locations of the serialized models, relative to the project root
+RECOGNIZER = os.path.join('facial_recognition', 'output', 'recognizer.pickle')
+LE = os.path.join('facial_recognition', 'output', 'le.pickle')
+MATCHER = "svc"
+
+# the cosine similarity above which an enrolled embedding is taken to be one
+# the student already has, i.e. of an image that was enrolled before
+DUPLICATE_SIMILARITY = 0.9999
+
+# how often (in seconds) the embedding store and the model registry are
+# checked for new students or a retrained classifier
+RELOAD_INTERVAL = 5.0
+
+
+class Models:
+    """One version of the classifier, label encoder and stored embeddings,
+    replaced as a whole when a new version is published, so that a request
+    that already picked up a version finishes on it."""
+
+    def __init__(self, version, recognizer, le, gallery, matcher):
+        self.version = version
+        self.recognizer = recognizer
+        self.le = le
+        self.gallery = gallery
+        self.matcher = matcher
+        self.loaded_at = time.time()
+
+        # the sub-galleries of the classes, see candidate_gallery()
+        self.class_galleries = {}
+
+
+class RecognitionEngine:
+    """Holds the face detector, embedder, classifier and label encoder in memory
+    so that they are loaded once per process instead of once per image."""
+
+    def __init__(self, detector=DETECTOR, embedding_model=EMBEDDING_MODEL, recognizer=RECOGNIZER, le=LE,
+                 embeddings=EMBEDDINGS, confidence=CONFIDENCE, min_similarity=MIN_SIMILARITY, matcher=MATCHER,
+                 matcher_options=None, batching=False, max_batch=MAX_BATCH, max_wait=MAX_WAIT, pool_size=1,
+                 threads=None, result_cache_size=0, result_cache_ttl=TTL, duplicate_distance=MAX_DISTANCE,
+                 quality=None, backend="default", target="cpu", registry=REGISTRY, reload_interval=RELOAD_INTERVAL):
+        self.confidence = confidence
+        self.min_similarity = min_similarity
+
+        # the cv2.dnn backend and target, or "auto" to use the fastest
+        # configuration on this machine
+        if backend == "auto":
+            (backend, target) = fastest_config(detector, embedding_model)
+
+        # cv2.dnn.Net keeps its input between setInput() and forward(), so
+        # every request checks out its own detector/embedder pair
+        self.pool = NetPool(pool_size, detector, embedding_model, threads, backend, target)
+
+        # load the actual face recognition model along with the label encoder
+        # (only needed when matching with the SVC), preferably from the model
+        # registry, and the stored embeddings used to match faces against the
+        # students of a single class (and against everyone by the gallery
+        # matchers)
+        self._recognizer = recognizer
+        self._le = le
+        self._registry = registry
+        self._matcher_name = matcher
+        self._matcher_options = matcher_options or {}
+        self._embeddings = embeddings
+        self._models_lock = threading.Lock()
+        self.models = self._load_models(self._artifacts_version())
+
+        # new versions are loaded by a background thread and swapped in, so
+        # requests never wait for a reload
+        self.reload_interval = reload_interval
+        self.reload_error = None
+        if reload_interval:
+            threading.Thread(target=self._watch, name="recognition-reload", daemon=True).start()
+
+        # optionally embed the faces of concurrent requests in shared batches
+        self.batcher = MicroBatcher(self._embed, self._match, max_batch, max_wait) if batching else None
+
+        # optionally answer near-duplicate captures from recently computed results
+        self.result_cache = ResultCache(result_cache_size, result_cache_ttl, duplicate_distance) \
+            if result_cache_size else None
+
+        # optionally reject unusable faces before embedding them; quality
+        # holds the QualityGate thresholds
+        self.quality_gate = QualityGate(**quality) if quality is not None else None
+
+    def _artifacts_version(self):
+        # identifies the classifier and the embedding store on disk: the
+        # published registry version (or the mtimes of the plain pickles)
+        # and the mtime of the store
+        classifier = None
+        if self._matcher_name == "svc":
+            registry_version = current_version(self._registry)
+            if registry_version is not None:
+                classifier = ("registry", registry_version)
+            else:
+                classifier = (os.stat(self._recognizer).st_mtime, os.stat(self._le).st_mtime)
+        return classifier, modified_time(self._embeddings)
+
+    def _load_models(self, version):
+        (classifier, _) = version
+        recognizer = le = None
+        if classifier is not None and classifier[0] == "registry":
+            print("[INFO] loading recognizer version {}...".format(classifier[1]))
+            (recognizer, le) = load_version(classifier[1], self._registry)
+        elif classifier is not None:
+            print("[INFO] loading recognizer...")
+            with open(self._recognizer, "rb") as f:
+                recognizer = pickle.loads(f.read())
+            with open(self._le, "rb") as f:
+                le = pickle.loads(f.read())
+
+        print("[INFO] loading face embeddings...")
+        gallery = Gallery.load(self._embeddings)
+        matcher = build_matcher(self._matcher_name, gallery=gallery, recognizer=recognizer, le=le,
+                                min_similarity=self.min_similarity, **self._matcher_options)
+        return Models(version, recognizer, le, gallery, matcher)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                self.reload()
+                self.reload_error = None
+            except Exception as e:
+                # e.g. a version deleted while it was loaded; keep serving the
+                # current models and try again
+                self.reload_error = str(e)
+                print("[WARNING] unable to reload the recognition models: {}".format(e))
+
+    def reload(self):
+        # load a newly published classifier or embedding store (e.g. students
+        # enrolled by another process) and swap it in; the slow loading
+        # happens outside of the lock
+        version = self._artifacts_version()
+        if version == self.models.version:
+            return False
+        models = self._load_models(version)
+        with self._models_lock:
+            if self.models.version == version:
+                return False
+            self.models = models
+        return True
+
+    def enroll(self, name, images):
+        # embed the student's images and append them to the embedding store,
+        # which this and the other workers then reload; returns the number of
+        # embeddings added
+        with self.pool.checkout() as nets:
+            faces = [nets.embed_largest_face(image, self.confidence) for image in images]
+        vecs = [face["vec"] for face in faces if face is not None]
+        if not vecs:
+            return 0
+
+        # the store is re-read under the lock rather than taken from
+        # self.models, which may be up to reload_interval old or miss a
+        # student enrolled by another process meanwhile
+        with store_lock(self._embeddings):
+            gallery = Gallery.load(self._embeddings)
+
+            # an image always embeds to the same vector, so images the student
+            # was already enrolled with (or given twice) are skipped instead
+            # of stored again
+            known = gallery.vectors[gallery.names == name]
+            new = []
+            for vec in normalize(vecs):
+                if len(known) and float(np.max(known @ vec)) >= DUPLICATE_SIMILARITY:
+                    continue
+                new.append(vec)
+                known = np.vstack([known, vec])
+            if new:
+                gallery.append(new, [name] * len(new)).save(self._embeddings)
+        if new:
+            self.reload()
+        return len(new)
+
+    def candidate_gallery(self, key, names):
+        # the sub-gallery of the students enrolled in one class (keyed by e.g.
+        # the class date id), rebuilt only when the roster or models change
+        models = self.models
+        names = frozenset(names)
+        cached = models.class_galleries.get(key)
+        if cached is None or cached[0] != names:
+            cached = (names, models.gallery.subset(names))
+            models.class_galleries[key] = cached
+        return cached[1]
+
+    def evict_candidates(self, key):
+        # drop the sub-gallery of a class whose attendance taking has stopped
+        self.models.class_galleries.pop(key, None)
+
+    def _embed(self, faces):
+        with self.pool.checkout() as nets:
+            return nets.embed(faces)
+
+    def _match(self, vecs, candidates):
+        # candidates is a matcher or a candidate gallery; the probability of
+        # a gallery match is its cosine similarity
+        matcher = CosineMatcher(candidates, self.min_similarity) if isinstance(candidates, Gallery) else candidates
+        return matcher.match(vecs)
+
+    def detect(self, image, confidence=None):
+        # the face crops, detection confidences and boxes of an image
+        if confidence is None:
+            confidence = self.confidence
+        with self.pool.checkout() as nets:
+            return nets.detect(image, confidence)
+
+    def identify(self, crops, candidates=None):
+        # the (name, score) of every face crop; when a candidate gallery is
+        # given, faces are only matched against it, otherwise against the
+        # matcher of the current models
+        if candidates is None:
+            candidates = self.models.matcher
+        if self.batcher is not None:
+            return self.batcher.submit(crops, candidates)
+        return self._match(self._embed(crops), candidates)
+
+    def screen(self, faces, image):
+        # the reason every face of the image is rejected by the quality gate,
+        # or None
+        if self.quality_gate is None:
+            return [None] * len(faces)
+        return self.quality_gate.screen(faces, image.shape[1])
+
+    def recognize_all(self, image, confidence=None, candidates=None, gate=False):
+        # recognize every face in the image, e.g. a photo of the whole classroom;
+        # with gate, faces rejected by the quality gate are not embedded
+        if self.result_cache is not None:
+            # a cached result is only valid for the same models and gallery
+            image_hash = dhash(image)
+            context = (self.models.version, confidence, candidates, gate)
+            results = self.result_cache.get(image_hash, context)
+            if results is not None:
+                return [dict(result) for result in results]
+
+        faces = self.detect(image, confidence)
+        reasons = self.screen(faces, image) if gate else [None] * len(faces)
+        accepted = [face for (face, reason) in zip(faces, reasons) if reason is None]
+        matches = []
+        if accepted:
+            started = time.perf_counter()
+            matches = self.identify([f["face"] for f in accepted], candidates)
+            if gate and self.quality_gate is not None:
+                self.quality_gate.record_embedding(len(accepted), time.perf_counter() - started)
+
+        # rejected faces are reported as unknown, along with the reason
+        matches = iter(matches)
+        results = []
+        for (face, reason) in zip(faces, reasons):
+            if reason is None:
+                (name, score) = next(matches)
+                results.append({"name": name, "confidence": face["confidence"], "probability": score,
+                                "box": face["box"]})
+            else:
+                results.append({"name": "unknown", "confidence": face["confidence"], "probability": 0.0,
+                                "box": face["box"], "rejected": reason})
+
+        if self.result_cache is not None:
+            self.result_cache.put(image_hash, context, [dict(result) for result in results])
+        return results
+
+    def recognize(self, image, confidence=None, candidates=None):
+        # a kiosk capture is expected to contain one face; as before, the
+        # last face that passes the threshold (and the quality gate) is the
+        # one reported
+        results = self.recognize_all(image, confidence=confidence, candidates=candidates, gate=True)
+        if not results:
+            if self.quality_gate is not None:
+                self.quality_gate.reject("no_face")
+            return {"name": "unknown", "confidence": 0.0, "probability": 0.0, "rejected": "no_face"}
+        accepted = [result for result in results if "rejected" not in result]
+        return accepted[-1] if accepted else results[-1]
+
+    def stats(self):
+        models = self.models
+        return {"models": {"version": models.version[0] and list(models.version[0]),
+                           "embeddings_mtime": models.version[1], "loaded_at": models.loaded_at,
+                           "identities": len(set(models.gallery.names)), "reload_error": self.reload_error},
+                "pool": {"size": self.pool.size, "threads": self.pool.threads, "backend": self.pool.backend,
+                         "target": self.pool.target},
+                "batching": self.batcher.stats() if self.batcher is not None else None,
+                "result_cache": self.result_cache.stats() if self.result_cache is not None else None,
+                "quality": self.quality_gate.stats() if self.quality_gate is not None else None}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(**config):
+    # build the engine the first time it is asked for and reuse it for the
+    # lifetime of the process (i.e. once per gunicorn worker)
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RecognitionEngine(**config)
+    return _engine
+
+
+def loaded_engine():
+    # the engine of this process, or None when nothing needed it yet
+    return _engine
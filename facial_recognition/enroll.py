@@ -0,0 +1,75 @@
+# USAGE
+# python -m facial_recognition.enroll --name U1922175D --images ~/photos/U1922175D
+
+# import the necessary packages
+from facial_recognition import engine
+from facial_recognition.embedding_cache import file_digest
+from facial_recognition.embedding_store import store_lock
+from imutils import paths
+import argparse
+import shutil
+import os
+
+
+def list_images(sources):
+    # the given image files, plus every image inside the given directories
+    image_paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            image_paths.extend(sorted(paths.list_images(source)))
+        else:
+            image_paths.append(source)
+    return image_paths
+
+
+def copy_to_dataset(name, image_paths, dataset):
+    # keep the images in the dataset, so that the next training run (which
+    # rebuilds the store from the dataset) keeps the student; files are named
+    # by content so that enrolling the same image twice copies it once
+    directory = os.path.join(dataset, name)
+    os.makedirs(directory, exist_ok=True)
+    for image_path in image_paths:
+        if os.path.dirname(os.path.abspath(image_path)) == os.path.abspath(directory):
+            continue
+        target = os.path.join(directory, file_digest(image_path)[:16] + os.path.splitext(image_path)[1].lower())
+        if not os.path.exists(target):
+            shutil.copyfile(image_path, target)
+
+
+def main():
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--name", required=True,
+                    help="matric number of the student to enroll")
+    ap.add_argument("-i", "--images", required=True, nargs="+",
+                    help="images of the student, or directories containing them")
+    ap.add_argument("-e", "--embeddings", default=engine.EMBEDDINGS,
+                    help="path to the embedding store")
+    ap.add_argument("-D", "--dataset", default=os.path.join('facial_recognition', 'dataset'),
+                    help="dataset directory the images are copied to (empty to skip)")
+    ap.add_argument("-d", "--detector", default=engine.DETECTOR,
+                    help="path to OpenCV's deep learning face detector")
+    ap.add_argument("-m", "--embedding-model", default=engine.EMBEDDING_MODEL,
+                    help="path to OpenCV's deep learning face embedding model")
+    ap.add_argument("-c", "--confidence", type=float, default=engine.CONFIDENCE,
+                    help="minimum probability to filter weak detections")
+    args = vars(ap.parse_args())
+
+    # only the new student's images are embedded; the SVC is not needed since
+    # the student is appended to the stored gallery
+    recognition_engine = engine.RecognitionEngine(detector=args["detector"],
+                                                  embedding_model=args["embedding_model"],
+                                                  embeddings=args["embeddings"], confidence=args["confidence"],
+                                                  matcher="cosine")
+    image_paths = list_images(args["images"])
+    print("[INFO] embedding {} image(s) of {}...".format(len(image_paths), args["name"]))
+    images = [image for image in (engine.read_image(image_path) for image_path in image_paths) if image is not None]
+    with store_lock(args["embeddings"]):
+        total = recognition_engine.enroll(args["name"], images)
+        if total and args["dataset"]:
+            copy_to_dataset(args["name"], image_paths, args["dataset"])
+    print("[INFO] enrolled {} with {} new encoding(s)".format(args["name"], total))
+
+
+if __name__ == '__main__':
+    main()
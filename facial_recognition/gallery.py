@@ -0,0 +1,61 @@
+# import the necessary packages
+from facial_recognition.embedding_store import STORE, EMBEDDING_SIZE, is_store, load_store, save_store
+import numpy as np
+import pickle
+
+EMBEDDINGS = STORE
+
+# minimum cosine similarity between a face and its closest stored embedding
+# for the face to be accepted as that student (OpenFace's squared L2
+# distance threshold of ~1.0 on unit vectors)
+MIN_SIMILARITY = 0.5
+
+
+def normalize(vectors):
+    # scale every row to unit length so that a dot product is the cosine similarity
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class Gallery:
+    """The stored 128-d face embeddings as one normalized float32 matrix, with
+    the name (matric number) of every row."""
+
+    def __init__(self, embeddings, names, normalized=False):
+        self.names = np.asarray(names, dtype=str)
+        if normalized and getattr(embeddings, "dtype", None) == np.float32:
+            # e.g. a memory-mapped float32 store, used without a copy
+            self.vectors = embeddings
+        else:
+            self.vectors = normalize(np.asarray(embeddings).reshape(len(self.names), EMBEDDING_SIZE))
+
+    @classmethod
+    def load(cls, path=EMBEDDINGS):
+        # an embedding store is memory-mapped; a legacy embeddings.pickle is
+        # still readable until it has been converted
+        if is_store(path):
+            (vectors, names, _) = load_store(path)
+            return cls(vectors, names, normalized=True)
+        with open(path, "rb") as f:
+            data = pickle.loads(f.read())
+        return cls(data["embeddings"], data["names"])
+
+    def save(self, path=EMBEDDINGS):
+        save_store(path, self.vectors, self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def subset(self, names):
+        # the rows belonging to the given students only, e.g. the students
+        # enrolled in one class
+        mask = np.isin(self.names, list(names))
+        return Gallery(self.vectors[mask], self.names[mask])
+
+    def append(self, embeddings, names):
+        # a new gallery with the given rows added, e.g. a newly enrolled student
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(names), EMBEDDING_SIZE)
+        return Gallery(np.concatenate([self.vectors, embeddings]),
+                       np.concatenate([self.names, np.asarray(names, dtype=str)]))
@@ -0,0 +1,135 @@
+# import the necessary packages
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import uuid
+import json
+import time
+import glob
+import os
+
+WORKERS = 2
+MAX_PENDING = 32
+RESULT_TTL = 120.0
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the pool is saturated."""
+
+
+class JobQueue:
+    """Runs recognition jobs on a dedicated, bounded pool of worker threads so
+    that web worker threads only submit a capture and return a job id.
+
+    At most max_pending jobs may be queued or running; further submissions
+    raise QueueFull. Finished jobs are kept for result_ttl seconds.
+
+    With a job_dir, the status of every job is also written to a file there,
+    so that any worker process of the web server can answer a poll for a job
+    accepted by another one."""
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING, result_ttl=RESULT_TTL, job_dir=None):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="recognition-job")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self.result_ttl = result_ttl
+        self.job_dir = job_dir
+        if job_dir:
+            os.makedirs(job_dir, exist_ok=True)
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull()
+        self._expire()
+
+        job_id = uuid.uuid4().hex
+        job = {"status": "pending", "result": None, "error": None, "finished_at": None,
+               "done": threading.Event()}
+        with self._lock:
+            self._jobs[job_id] = job
+        self._write(job_id, job)
+        self._executor.submit(self._run, job_id, job, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, job, fn, args, kwargs):
+        job["status"] = "running"
+        try:
+            job["result"] = fn(*args, **kwargs)
+            job["status"] = "done"
+        except Exception as e:
+            job["error"] = str(e)
+            job["status"] = "failed"
+        finally:
+            job["finished_at"] = time.monotonic()
+            self._write(job_id, job)
+            self._slots.release()
+            job["done"].set()
+
+    def _path(self, job_id):
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def _write(self, job_id, job):
+        # replace the job's file in one step, so a reader never sees half of it
+        if not self.job_dir:
+            return
+        try:
+            tmp_path = self._path(job_id) + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"status": job["status"], "result": job["result"], "error": job["error"]}, f)
+            os.replace(tmp_path, self._path(job_id))
+        except (OSError, TypeError, ValueError) as e:
+            print("[WARNING] unable to write the status of job {}: {}".format(job_id, e))
+
+    def _read(self, job_id):
+        # the status of a job accepted by another process, if it has one
+        if not self.job_dir or not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, job_id, wait=0.0):
+        # the job's status and result, or None for an unknown or expired job;
+        # with wait, block up to that many seconds for the job to finish
+        # (long polling)
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return self._read(job_id)
+        if wait:
+            job["done"].wait(wait)
+        return {"status": job["status"], "result": job["result"], "error": job["error"]}
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [job_id for (job_id, job) in self._jobs.items()
+                       if job["finished_at"] is not None and now - job["finished_at"] > self.result_ttl]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+        # the files of every process' jobs, including jobs lost with a
+        # crashed process
+        if self.job_dir:
+            for path in glob.glob(os.path.join(self.job_dir, "*.json")):
+                try:
+                    if time.time() - os.stat(path).st_mtime > self.result_ttl:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue(**config):
+    # one job queue (and worker pool) per process
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue(**config)
+    return _job_queue
@@ -0,0 +1,113 @@
+# import the necessary packages
+from facial_recognition.gallery import normalize, MIN_SIMILARITY
+import numpy as np
+
+MATCHERS = ("svc", "cosine", "ivf")
+
+
+class SVCMatcher:
+    """Matches faces with the trained SVC and its label encoder."""
+
+    def __init__(self, recognizer, le):
+        self.recognizer = recognizer
+        self.le = le
+
+    def match(self, vecs):
+        # perform classification to recognize all the faces at once
+        preds = self.recognizer.predict_proba(vecs)
+        best = np.argmax(preds, axis=1)
+        return [(str(self.le.classes_[j]), float(preds[i, j])) for (i, j) in enumerate(best)]
+
+
+class CosineMatcher:
+    """Exact nearest neighbour search over the gallery: every query is scored
+    against every stored embedding with one BLAS matrix multiply."""
+
+    def __init__(self, gallery, min_similarity=MIN_SIMILARITY):
+        self.gallery = gallery
+        self.min_similarity = min_similarity
+
+    @property
+    def nbytes(self):
+        return self.gallery.vectors.nbytes + self.gallery.names.nbytes
+
+    def search(self, vecs, k=1):
+        # the k most similar gallery rows of every query, best first
+        similarities = normalize(vecs) @ self.gallery.vectors.T
+        k = min(k, similarities.shape[1])
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        return top, np.take_along_axis(scores, order, axis=1)
+
+    def match(self, vecs):
+        if len(self.gallery) == 0:
+            return [("unknown", 0.0)] * len(vecs)
+        (top, scores) = self.search(vecs, 1)
+        return [(str(self.gallery.names[j]) if score >= self.min_similarity else "unknown", float(score))
+                for (j, score) in zip(top[:, 0], scores[:, 0])]
+
+
+class IVFMatcher(CosineMatcher):
+    """Inverted file index for very large galleries: the gallery is partitioned
+    around k-means centroids and a query is only scored against the rows of its
+    n_probe closest partitions."""
+
+    def __init__(self, gallery, min_similarity=MIN_SIMILARITY, n_lists=None, n_probe=8, iterations=10, seed=42):
+        super().__init__(gallery, min_similarity)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(gallery))))
+        self.n_probe = n_probe
+
+        # spherical k-means over the normalized embeddings
+        vectors = gallery.vectors
+        n_lists = max(1, min(n_lists, len(vectors)))
+        centroids = np.zeros((n_lists, vectors.shape[1]), dtype=np.float32)
+        assignment = np.zeros(len(vectors), dtype=np.int64)
+        if len(vectors):
+            rng = np.random.RandomState(seed)
+            centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(vectors @ centroids.T, axis=1)
+                for c in range(n_lists):
+                    members = vectors[assignment == c]
+                    if len(members):
+                        centroids[c] = members.sum(axis=0)
+                centroids = normalize(centroids)
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+        self.centroids = centroids
+
+        # the gallery rows of every partition, contiguously, so that a probe is
+        # a slice of self.rows; the (possibly memory-mapped) gallery matrix is
+        # indexed directly rather than copied in partition order
+        self.rows = np.argsort(assignment, kind="stable")
+        self.offsets = np.searchsorted(assignment[self.rows], np.arange(n_lists + 1))
+
+    @property
+    def nbytes(self):
+        return super().nbytes + self.centroids.nbytes + self.rows.nbytes + self.offsets.nbytes
+
+    def search(self, vecs, k=1):
+        vecs = normalize(vecs)
+        probes = np.argsort(-(vecs @ self.centroids.T), axis=1)[:, :self.n_probe]
+        tops = np.full((len(vecs), k), -1, dtype=np.int64)
+        scores = np.full((len(vecs), k), -np.inf, dtype=np.float32)
+        for (i, lists) in enumerate(probes):
+            candidates = np.concatenate([self.rows[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+            similarities = self.gallery.vectors[candidates] @ vecs[i]
+            n = min(k, len(candidates))
+            best = np.argsort(-similarities)[:n]
+            tops[i, :n] = candidates[best]
+            scores[i, :n] = similarities[best]
+        return tops, scores
+
+
+def build_matcher(name, gallery=None, recognizer=None, le=None, min_similarity=MIN_SIMILARITY, **options):
+    if name == "svc":
+        return SVCMatcher(recognizer, le)
+    if name == "cosine":
+        return CosineMatcher(gallery, min_similarity)
+    if name == "ivf":
+        return IVFMatcher(gallery, min_similarity, **options)
+    raise ValueError(f"unknown matcher '{name}', expected one of {', '.join(MATCHERS)}")
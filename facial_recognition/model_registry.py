@@ -0,0 +1,68 @@
+# import the necessary packages
+import pickle
+import json
+import time
+import os
+
+# the registry is a directory of numbered recognizer/label encoder versions
+# and a manifest naming the current one
+REGISTRY = os.path.join('facial_recognition', 'output', 'models')
+MANIFEST = "manifest.json"
+
+# the number of older versions kept next to the current one, so that
+# workers still loading a version do not find it deleted
+KEEP = 2
+
+
+def read_manifest(path=REGISTRY):
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def current_version(path=REGISTRY):
+    # the number of the published version, or None for an empty registry
+    manifest = read_manifest(path)
+    return manifest["current"] if manifest else None
+
+
+def publish(recognizer, le, path=REGISTRY, **info):
+    # write a new version and then swap in a manifest naming it, so that
+    # readers never see a half written version; info (e.g. the number of
+    # identities) is recorded in the manifest
+    os.makedirs(path, exist_ok=True)
+    manifest = read_manifest(path) or {"current": 0, "versions": {}}
+    version = manifest["current"] + 1
+    entry = dict(info, recognizer=f"recognizer.{version}.pickle", le=f"le.{version}.pickle", published=time.time())
+    with open(os.path.join(path, entry["recognizer"]), "wb") as f:
+        f.write(pickle.dumps(recognizer))
+    with open(os.path.join(path, entry["le"]), "wb") as f:
+        f.write(pickle.dumps(le))
+
+    manifest["current"] = version
+    manifest["versions"][str(version)] = entry
+    for old in sorted(manifest["versions"], key=int)[:-(KEEP + 1)]:
+        for key in ("recognizer", "le"):
+            try:
+                os.remove(os.path.join(path, manifest["versions"][old][key]))
+            except OSError:
+                pass
+        del manifest["versions"][old]
+
+    tmp_path = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+    return version
+
+
+def load_version(version, path=REGISTRY):
+    # the recognizer and label encoder of a published version
+    entry = read_manifest(path)["versions"][str(version)]
+    with open(os.path.join(path, entry["recognizer"]), "rb") as f:
+        recognizer = pickle.loads(f.read())
+    with open(os.path.join(path, entry["le"]), "rb") as f:
+        le = pickle.loads(f.read())
+    return recognizer, le
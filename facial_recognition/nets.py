@@ -0,0 +1,254 @@
+# import the necessary packages
+from contextlib import contextmanager
+import numpy as np
+import queue
+import time
+import cv2
+import os
+
+# default locations of the serialized networks, relative to the project root
+DETECTOR = os.path.join('facial_recognition', 'face_detection_model')
+EMBEDDING_MODEL = os.path.join('facial_recognition', 'openface_nn4.small2.v1.t7')
+CONFIDENCE = 0.5
+
+# images are decoded at (at least) DETECTION_WIDTH pixels wide, and faces
+# smaller than MIN_FACE pixels at that width are ignored
+DETECTION_WIDTH = 600
+MIN_FACE = 20
+
+# bumped whenever the preprocessing changes the computed embeddings, so
+# that cached embeddings are recomputed
+PREPROCESSING = 2
+
+# the cv2.dnn backends and targets that can be configured; only CPU targets
+# are offered since the servers have no GPU
+BACKENDS = {"default": cv2.dnn.DNN_BACKEND_DEFAULT, "opencv": cv2.dnn.DNN_BACKEND_OPENCV}
+if hasattr(cv2.dnn, "DNN_BACKEND_INFERENCE_ENGINE"):
+    BACKENDS["openvino"] = cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE
+TARGETS = {"cpu": cv2.dnn.DNN_TARGET_CPU}
+if hasattr(cv2.dnn, "DNN_TARGET_CPU_FP16"):
+    TARGETS["cpu_fp16"] = cv2.dnn.DNN_TARGET_CPU_FP16
+
+# JPEG start-of-frame markers (every SOFn except DHT, JPG and DAC)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+REDUCED_COLOR = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                 (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def jpeg_size(data):
+    # the (width, height) from the start-of-frame header of a JPEG, or None
+    # when the data is not a JPEG
+    data = memoryview(data)
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # fill byte
+            i += 1
+            continue
+        if marker in SOF_MARKERS:
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            # markers without a payload
+            i += 2
+            continue
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+
+def decode_image(data, min_width=DETECTION_WIDTH):
+    # decode an encoded (e.g. JPEG) image straight from memory without
+    # going through a file on disk; large JPEGs are decoded at 1/2, 1/4 or
+    # 1/8 scale (which libjpeg does while decoding, far cheaper than a full
+    # decode followed by a resize) as long as they stay min_width wide
+    if not data:
+        raise ValueError("empty image")
+    flags = cv2.IMREAD_COLOR
+    size = jpeg_size(data) if min_width else None
+    if size is not None:
+        for (factor, reduced) in REDUCED_COLOR:
+            if size[0] // factor >= min_width:
+                flags = reduced
+                break
+    buffer = np.frombuffer(memoryview(data), dtype=np.uint8)
+    try:
+        image = cv2.imdecode(buffer, flags)
+    except cv2.error:
+        image = None
+    if image is None:
+        raise ValueError("unable to decode image")
+    return image
+
+
+def read_image(path, min_width=DETECTION_WIDTH):
+    # the image file at path, decoded like an upload, or None when it
+    # cannot be read
+    try:
+        with open(path, "rb") as f:
+            return decode_image(f.read(), min_width)
+    except (OSError, ValueError):
+        return None
+
+
+def model_files(path):
+    # the files of a serialized network: the directory holding the Caffe
+    # detector, or a single (Torch or ONNX) model file
+    if os.path.isdir(path):
+        return [os.path.sep.join([path, "deploy.prototxt"]),
+                os.path.sep.join([path, "res10_300x300_ssd_iter_140000.caffemodel"])]
+    return [path]
+
+
+def read_net(path, backend="default", target="cpu"):
+    # load a network from its Caffe directory, Torch (.t7) or ONNX (.onnx)
+    # file, e.g. an int8 or fp16 quantized ONNX export of the detector
+    if os.path.isdir(path):
+        net = cv2.dnn.readNetFromCaffe(*model_files(path))
+    elif path.endswith(".onnx"):
+        net = cv2.dnn.readNetFromONNX(path)
+    else:
+        net = cv2.dnn.readNetFromTorch(path)
+    net.setPreferableBackend(BACKENDS[backend])
+    net.setPreferableTarget(TARGETS[target])
+    return net
+
+
+def available_configs():
+    # the (backend, target) pairs this OpenCV build can run on the CPU
+    configs = []
+    for (backend, backend_id) in BACKENDS.items():
+        targets = cv2.dnn.getAvailableTargets(backend_id)
+        configs.extend((backend, target) for (target, target_id) in TARGETS.items() if target_id in targets)
+    return configs
+
+
+def fastest_config(detector=DETECTOR, embedding_model=EMBEDDING_MODEL, repeats=10):
+    # a startup self-test: time the detector and embedder on a synthetic
+    # capture with every available configuration and pick the fastest
+    image = np.random.RandomState(0).randint(0, 255, (480, 640, 3), dtype=np.uint8)
+    timings = {}
+    for (backend, target) in available_configs():
+        try:
+            nets = FaceNets(detector, embedding_model, backend, target)
+            nets.detect(image)
+            nets.embed([image[:200, :200]])
+            started = time.perf_counter()
+            for _ in range(repeats):
+                nets.detect(image)
+                nets.embed([image[:200, :200]])
+        except cv2.error:
+            continue
+        timings[(backend, target)] = (time.perf_counter() - started) / repeats
+        print("[INFO] {}/{}: {:.1f} ms per capture".format(backend, target, timings[(backend, target)] * 1000))
+    if not timings:
+        return ("default", "cpu")
+    return min(timings, key=timings.get)
+
+
+class FaceNets:
+    """OpenCV's SSD face detector and the OpenFace embedding network.
+
+    cv2.dnn.Net keeps its input between setInput() and forward(), so one
+    instance must only be driven by one thread at a time."""
+
+    def __init__(self, detector=DETECTOR, embedding_model=EMBEDDING_MODEL, backend="default", target="cpu"):
+        # load our serialized face detector from disk
+        print("[INFO] loading face detector...")
+        self.detector = read_net(detector, backend, target)
+
+        # load our serialized face embedding model from disk
+        print("[INFO] loading face recognizer...")
+        self.embedder = read_net(embedding_model, backend, target)
+
+    def detect(self, image, confidence=CONFIDENCE):
+        # grab the image dimensions and construct a blob from the image;
+        # blobFromImage resizes straight to 300x300 in a single pass
+        (h, w) = image.shape[:2]
+        image_blob = cv2.dnn.blobFromImage(
+            image, 1.0, (300, 300),
+            (104.0, 177.0, 123.0), swapRB=False, crop=False)
+        min_face = MIN_FACE * w / DETECTION_WIDTH
+
+        # apply OpenCV's deep learning-based face detector to localize
+        # faces in the input image
+        # (ONNX exports may drop the leading dimensions of the SSD output)
+        self.detector.setInput(image_blob)
+        detections = self.detector.forward().reshape(1, 1, -1, 7)
+
+        # loop over the detections and keep the face ROIs that pass the
+        # confidence threshold and are sufficiently large
+        faces = []
+        for i in range(0, detections.shape[2]):
+            face_confidence = float(detections[0, 0, i, 2])
+            if face_confidence <= confidence:
+                continue
+
+            # compute the (x, y)-coordinates of the bounding box for the face
+            box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
+            (start_x, start_y, end_x, end_y) = box.astype("int")
+            (start_x, start_y) = (max(0, start_x), max(0, start_y))
+
+            # the face ROI is a view of the decoded image, not a copy
+            face = image[start_y:end_y, start_x:end_x]
+            (f_h, f_w) = face.shape[:2]
+            if f_w < min_face or f_h < min_face:
+                continue
+
+            faces.append({"face": face, "confidence": face_confidence,
+                          "box": [int(start_x), int(start_y), int(end_x), int(end_y)]})
+        return faces
+
+    def embed(self, faces):
+        # construct one blob for all the face ROIs, then pass it through our
+        # face embedding model in a single forward pass to obtain the 128-d
+        # quantification of every face
+        faces_blob = cv2.dnn.blobFromImages(faces, 1.0 / 255, (96, 96),
+                                            (0, 0, 0), swapRB=True, crop=False)
+        self.embedder.setInput(faces_blob)
+        return self.embedder.forward()
+
+    def embed_largest_face(self, image, confidence=CONFIDENCE):
+        # we're making the assumption that each enrollment image has only ONE
+        # face, so keep the detection with the largest probability
+        faces = self.detect(image, confidence)
+        if not faces:
+            return None
+        face = max(faces, key=lambda f: f["confidence"])
+        return {"box": face["box"], "confidence": face["confidence"],
+                "vec": self.embed([face["face"]])[0]}
+
+
+class NetPool:
+    """A fixed number of preloaded FaceNets, checked out by one request (thread)
+    at a time, so that several requests can run the networks in parallel.
+
+    OpenCV's thread count is process wide; it is set so that the networks of
+    the whole pool together use about one thread per core."""
+
+    def __init__(self, size=1, detector=DETECTOR, embedding_model=EMBEDDING_MODEL, threads=None, backend="default",
+                 target="cpu"):
+        if threads is None:
+            threads = max(1, (os.cpu_count() or 1) // size)
+        cv2.setNumThreads(threads)
+        self.size = size
+        self.threads = threads
+        self.backend = backend
+        self.target = target
+        self._nets = queue.Queue()
+        for _ in range(size):
+            self._nets.put(FaceNets(detector, embedding_model, backend, target))
+
+    @contextmanager
+    def checkout(self):
+        # wait for a free instance and return it to the pool afterwards
+        nets = self._nets.get()
+        try:
+            yield nets
+        finally:
+            self._nets.put(nets)
@@ -0,0 +1,100 @@
+# import the necessary packages
+from facial_recognition.nets import DETECTION_WIDTH
+import threading
+import cv2
+
+# default thresholds; sharpness is the variance of the Laplacian and
+# brightness the mean gray level of the face resized to the embedder's input,
+# size the shorter side of the face box in pixels of an image DETECTION_WIDTH
+# pixels wide (scaled with the width of the actual image, like the detector's
+# MIN_FACE)
+MIN_SHARPNESS = 20.0
+MIN_BRIGHTNESS = 40.0
+MAX_BRIGHTNESS = 220.0
+MIN_SIZE = 40
+MIN_CONFIDENCE = 0.6
+
+# the reasons a capture is rejected, with the message shown at the kiosk
+REASONS = {
+    "no_face": "No face was found, please face the camera",
+    "too_small": "Your face is too far away, please come closer to the camera",
+    "low_confidence": "Your face is not clearly visible, please face the camera",
+    "blurry": "The photo is blurry, please hold still",
+    "too_dark": "The photo is too dark, please move to a brighter spot",
+    "too_bright": "The photo is too bright, please avoid strong light behind or on you",
+}
+
+
+class QualityGate:
+    """Rejects faces that are too small, uncertain, blurry, dark or bright
+    before they go through the embedder and matcher, which would most likely
+    come back with "unknown" for them anyway.
+
+    Keeps the number of faces checked and rejected (per reason), and the
+    average cost of embedding and matching a face, to estimate the time the
+    gate saved."""
+
+    def __init__(self, min_sharpness=MIN_SHARPNESS, min_brightness=MIN_BRIGHTNESS, max_brightness=MAX_BRIGHTNESS,
+                 min_size=MIN_SIZE, min_confidence=MIN_CONFIDENCE):
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_size = min_size
+        self.min_confidence = min_confidence
+
+        # metrics
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._rejected = dict.fromkeys(REASONS, 0)
+        self._embedded = 0
+        self._embed_time = 0.0
+
+    def check(self, face, width=DETECTION_WIDTH):
+        # the reason the detected face of an image width pixels wide is
+        # rejected, or None when it is usable; the cheapest tests go first
+        (start_x, start_y, end_x, end_y) = face["box"]
+        if min(end_x - start_x, end_y - start_y) < self.min_size * width / DETECTION_WIDTH:
+            return "too_small"
+        if face["confidence"] < self.min_confidence:
+            return "low_confidence"
+
+        gray = cv2.cvtColor(face["face"], cv2.COLOR_BGR2GRAY)
+        gray = cv2.resize(gray, (96, 96), interpolation=cv2.INTER_AREA)
+        brightness = gray.mean()
+        if brightness < self.min_brightness:
+            return "too_dark"
+        if brightness > self.max_brightness:
+            return "too_bright"
+        if cv2.Laplacian(gray, cv2.CV_64F).var() < self.min_sharpness:
+            return "blurry"
+        return None
+
+    def screen(self, faces, width=DETECTION_WIDTH):
+        # the rejection reason (or None) of every face of an image
+        reasons = [self.check(face, width) for face in faces]
+        with self._lock:
+            self._checked += len(faces)
+            for reason in reasons:
+                if reason is not None:
+                    self._rejected[reason] += 1
+        return reasons
+
+    def reject(self, reason):
+        # count a capture rejected before any face could be checked
+        with self._lock:
+            self._rejected[reason] += 1
+
+    def record_embedding(self, faces, seconds):
+        with self._lock:
+            self._embedded += faces
+            self._embed_time += seconds
+
+    def stats(self):
+        with self._lock:
+            rejected = sum(count for (reason, count) in self._rejected.items() if reason != "no_face")
+            cost = self._embed_time / self._embedded if self._embedded else 0.0
+            return {"checked": self._checked, "rejected": rejected,
+                    "rejection_rate": rejected / self._checked if self._checked else 0.0,
+                    "reasons": dict(self._rejected),
+                    "mean_embedding_ms": cost * 1000,
+                    "time_saved_ms": rejected * cost * 1000}
@@ -1,110 +1,54 @@
 # USAGE
-# python recognize.py --detector face_detection_model \
-#	--embedding-model openface_nn4.small2.v1.t7 \
-#	--recognizer output/recognizer.pickle \
-#	--le output/le.pickle --image images/adrian.jpg
+# python -m facial_recognition.recognize --detector facial_recognition/face_detection_model \
+#	--embedding-model facial_recognition/openface_nn4.small2.v1.t7 \
+#	--recognizer facial_recognition/output/recognizer.pickle \
+#	--le facial_recognition/output/le.pickle --image images/adrian.jpg
 
 # import the necessary packages
-import numpy as np
+from facial_recognition import engine
+from facial_recognition.matchers import MATCHERS
+from facial_recognition.nets import BACKENDS, TARGETS
 import argparse
-import imutils
-import pickle
-import cv2
-import os
 
-def recognize_image():
+
+def main():
 
 	# construct the argument parser and parse the arguments
 	ap = argparse.ArgumentParser()
-	ap.add_argument("-i", "--image", default="facial_recognition/image/photo.jpg",
+	ap.add_argument("-i", "--image", required=True,
 		help="path to input image")
-	ap.add_argument("-d", "--detector", default='facial_recognition/face_detection_model',
+	ap.add_argument("-d", "--detector", default=engine.DETECTOR,
 		help="path to OpenCV's deep learning face detector")
-	ap.add_argument("-m", "--embedding-model", default='facial_recognition/openface_nn4.small2.v1.t7',
+	ap.add_argument("-m", "--embedding-model", default=engine.EMBEDDING_MODEL,
 		help="path to OpenCV's deep learning face embedding model")
-	ap.add_argument("-r", "--recognizer", default='facial_recognition/output/recognizer.pickle',
+	ap.add_argument("-r", "--recognizer", default=engine.RECOGNIZER,
 		help="path to model trained to recognize faces")
-	ap.add_argument("-l", "--le", default='facial_recognition/output/le.pickle',
+	ap.add_argument("-l", "--le", default=engine.LE,
 		help="path to label encoder")
-	ap.add_argument("-c", "--confidence", type=float, default=0.5,
+	ap.add_argument("-c", "--confidence", type=float, default=engine.CONFIDENCE,
 		help="minimum probability to filter weak detections")
+	ap.add_argument("-e", "--embeddings", default=engine.EMBEDDINGS,
+		help="path to the embedding store")
+	ap.add_argument("-M", "--matcher", default=engine.MATCHER, choices=MATCHERS,
+		help="how faces are matched: the trained SVC or a search over the embeddings")
+	ap.add_argument("-b", "--backend", default="default", choices=list(BACKENDS) + ["auto"],
+		help="cv2.dnn backend to run the networks on (auto picks the fastest)")
+	ap.add_argument("-t", "--target", default="cpu", choices=TARGETS,
+		help="cv2.dnn target to run the networks on")
 	args = vars(ap.parse_args())
 
-	# load our serialized face detector from disk
-	print("[INFO] loading face detector...")
-	protoPath = os.path.sep.join([args["detector"], "deploy.prototxt"])
-	modelPath = os.path.sep.join([args["detector"],
-		"res10_300x300_ssd_iter_140000.caffemodel"])
-	detector = cv2.dnn.readNetFromCaffe(protoPath, modelPath)
-
-	# load our serialized face embedding model from disk
-	print("[INFO] loading face recognizer...")
-	embedder = cv2.dnn.readNetFromTorch(args["embedding_model"])
-
-	# load the actual face recognition model along with the label encoder
-	recognizer = pickle.loads(open(args["recognizer"], "rb").read())
-	le = pickle.loads(open(args["le"], "rb").read())
-
-	# load the image, resize it to have a width of 600 pixels (while
-	# maintaining the aspect ratio), and then grab the image dimensions
-	image = cv2.imread(args["image"])
-	image = imutils.resize(image, width=600)
-	(h, w) = image.shape[:2]
-
-	# construct a blob from the image
-	imageBlob = cv2.dnn.blobFromImage(
-		cv2.resize(image, (300, 300)), 1.0, (300, 300),
-		(104.0, 177.0, 123.0), swapRB=False, crop=False)
-
-	# apply OpenCV's deep learning-based face detector to localize
-	# faces in the input image
-	detector.setInput(imageBlob)
-	detections = detector.forward()
-
-	# loop over the detections
-	text = "unknown"
-	con = 0.0
-	for i in range(0, detections.shape[2]):
-		# extract the confidence (i.e., probability) associated with the
-		# prediction
-		confidence = detections[0, 0, i, 2]
-
-		# filter out weak detections
-		if confidence > args["confidence"]:
-			# compute the (x, y)-coordinates of the bounding box for the
-			# face
-			box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-			(startX, startY, endX, endY) = box.astype("int")
-
-			# extract the face ROI
-			face = image[startY:endY, startX:endX]
-			(fH, fW) = face.shape[:2]
-
-			# ensure the face width and height are sufficiently large
-			if fW < 20 or fH < 20:
-				continue
-
-			# construct a blob for the face ROI, then pass the blob
-			# through our face embedding model to obtain the 128-d
-			# quantification of the face
-			faceBlob = cv2.dnn.blobFromImage(face, 1.0 / 255, (96, 96),
-				(0, 0, 0), swapRB=True, crop=False)
-			embedder.setInput(faceBlob)
-			vec = embedder.forward()
-
-			# perform classification to recognize the face
-			preds = recognizer.predict_proba(vec)[0]
-			j = np.argmax(preds)
-			proba = preds[j]
-			name = le.classes_[j]
-
-			# draw the bounding box of the face along with the associated
-			# probability
-			text = f"{name}"
-			con = confidence
-	print(con)
-	return text
+	# load the models once and run the image through them
+	recognition_engine = engine.RecognitionEngine(detector=args["detector"],
+		embedding_model=args["embedding_model"], recognizer=args["recognizer"],
+		le=args["le"], embeddings=args["embeddings"], confidence=args["confidence"],
+		matcher=args["matcher"], backend=args["backend"], target=args["target"])
+	image = engine.read_image(args["image"])
+	if image is None:
+		raise SystemExit("unable to read {}".format(args["image"]))
+	result = recognition_engine.recognize(image)
+	print(result["confidence"])
+	return result["name"]
 
 
 if __name__ == '__main__':
-    print(recognize_image())
\ No newline at end of file
+	print(main())
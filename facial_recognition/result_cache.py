@@ -0,0 +1,85 @@
+# import the necessary packages
+from collections import OrderedDict
+import numpy as np
+import threading
+import time
+import cv2
+
+# dHash of HASH_SIZE x HASH_SIZE bits; two captures whose hashes differ in at
+# most MAX_DISTANCE bits are treated as the same capture
+HASH_SIZE = 16
+MAX_DISTANCE = 8
+
+MAX_SIZE = 128
+TTL = 10.0
+
+
+def dhash(image, size=HASH_SIZE):
+    # the difference hash of an image: downscale the grayscale image to
+    # (size + 1) x size pixels and record whether each pixel is brighter than
+    # its right neighbour; small changes in noise, exposure or compression
+    # leave most of the bits untouched
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class ResultCache:
+    """A small LRU cache of recognition results keyed by the perceptual hash
+    of the capture, so that a near-duplicate capture (a double click, a retry
+    after a wrong result) submitted within ttl seconds is answered without
+    running the networks.
+
+    Results are only reused within the same context, e.g. the same model
+    version and candidate gallery."""
+
+    def __init__(self, max_size=MAX_SIZE, ttl=TTL, max_distance=MAX_DISTANCE):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys = 0
+
+        # metrics
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_hash, context):
+        # the cached result of the closest fresh capture, or None
+        now = time.monotonic()
+        with self._lock:
+            best = None
+            for (key, (entry_hash, entry_context, result, stored_at)) in list(self._entries.items()):
+                if now - stored_at > self.ttl:
+                    del self._entries[key]
+                    continue
+                if entry_context != context:
+                    continue
+                distance = hamming(image_hash, entry_hash)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, key, result)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best[1])
+            return best[2]
+
+    def put(self, image_hash, context, result):
+        with self._lock:
+            self._keys += 1
+            self._entries[self._keys] = (image_hash, context, result, time.monotonic())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,252 @@
+# USAGE
+# python -m facial_recognition.service --address unix:/tmp/frats-recognition.sock
+# python -m facial_recognition.service --address 127.0.0.1:8765 --pool-size 2
+
+# import the necessary packages
+from facial_recognition.client import send_message, recv_message
+from facial_recognition.batching import MAX_BATCH, MAX_WAIT
+from facial_recognition.engine import get_engine, decode_image, RELOAD_INTERVAL
+from facial_recognition.embedding_store import STORE
+from facial_recognition.matchers import MATCHERS
+from facial_recognition.nets import BACKENDS, TARGETS, DETECTOR, EMBEDDING_MODEL
+from facial_recognition.quality import REASONS, MIN_SHARPNESS, MIN_BRIGHTNESS, MAX_BRIGHTNESS, MIN_SIZE, \
+    MIN_CONFIDENCE
+from facial_recognition.result_cache import TTL, MAX_DISTANCE
+from facial_recognition.tracking import get_stream_sessions, DETECT_EVERY, SKIP_DISTANCE, SESSION_TTL
+import socketserver
+import threading
+import argparse
+import socket
+import os
+
+
+class Recognizer:
+    """The recognition API of a process that holds the models itself. The
+    web app calls it directly, or through RecognitionClient when the models
+    run in a separate service process.
+
+    Images are passed encoded (e.g. JPEG bytes) and candidates as the key and
+    matric numbers of a class, so that every call can be sent as is."""
+
+    def __init__(self, engine, streams):
+        self.engine = engine
+        self.streams = streams
+
+    def _candidates(self, key, names):
+        if names is None:
+            return None
+        return self.engine.candidate_gallery(key, names)
+
+    def recognize(self, data, key=None, names=None, group=False):
+        # every face of a (group) photo, or the face of a kiosk capture along
+        # with the reason it was rejected, if it was
+        image = decode_image(data)
+        candidates = self._candidates(key, names)
+        if group:
+            return self.engine.recognize_all(image, candidates=candidates)
+        result = self.engine.recognize(image, candidates=candidates)
+        result["message"] = REASONS.get(result.get("rejected"))
+        return result
+
+    def warm(self, key, names):
+        # build the candidate gallery of a class ahead of its first request
+        return len(self._candidates(key, names))
+
+    def evict(self, key):
+        self.engine.evict_candidates(key)
+        return key
+
+    def stream_open(self, key, names=None):
+        return self.streams.open(self.engine, key, self._candidates(key, names))
+
+    def stream_frame(self, session_id, data, key=None, names=None):
+        # the faces that are new in the frame and the faces currently tracked,
+        # or None for an unknown or expired stream; with the key (and names)
+        # of the stream, a stream this process does not know, e.g. one opened
+        # by another web worker, is continued here instead
+        session = self.streams.get(session_id)
+        if session is None and key is not None:
+            self.streams.open(self.engine, key, self._candidates(key, names), session_id=session_id)
+            session = self.streams.get(session_id)
+        if session is None:
+            return None
+        faces = session.process(decode_image(data))
+        return {"key": session.key, "faces": faces, "tracks": [track.result() for track in session.tracks]}
+
+    def stream_close(self, session_id):
+        self.streams.close(session_id)
+        return session_id
+
+    def stats(self):
+        return dict(self.engine.stats(), streams=self.streams.stats())
+
+    def call(self, fields, payload):
+        # dispatch a request received by the service
+        op = fields.pop("op", None)
+        if op == "recognize":
+            return self.recognize(payload, **fields)
+        if op == "warm":
+            return self.warm(**fields)
+        if op == "evict":
+            return self.evict(**fields)
+        if op == "stream_open":
+            return self.stream_open(**fields)
+        if op == "stream_frame":
+            return self.stream_frame(data=payload, **fields)
+        if op == "stream_close":
+            return self.stream_close(**fields)
+        if op == "stats":
+            return self.stats()
+        raise KeyError(f"unknown operation '{op}'")
+
+
+def get_recognizer(streams=None, **config):
+    # the recognizer over this process' engine and stream sessions
+    return Recognizer(get_engine(**config), get_stream_sessions(**(streams or {})))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # a client keeps its connection open for any number of requests
+        while True:
+            try:
+                (fields, payload) = recv_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+            try:
+                reply = {"result": self.server.recognizer.call(fields, payload)}
+            except Exception as e:
+                reply = {"error": str(e), "type": type(e).__name__}
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                return
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(address, recognizer):
+    # serve the recognizer on "unix:/path/to/socket" or "host:port", one
+    # thread per connection
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        if os.path.exists(path):
+            os.remove(path)
+        server = _UnixServer(path, _Handler)
+    else:
+        (host, port) = address.rsplit(":", 1)
+        server = _TCPServer((host or "127.0.0.1", int(port)), _Handler)
+        server.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    server.recognizer = recognizer
+    return server
+
+
+def start(address, recognizer):
+    # serve in a background thread, e.g. to run the service and the web app
+    # in one process while testing
+    server = serve(address, recognizer)
+    threading.Thread(target=server.serve_forever, name="recognition-service", daemon=True).start()
+    return server
+
+
+def env(name, default, cast=str):
+    # the web app's setting of the same name (see models.py), so that the
+    # service is configured like an in-process engine by the same environment
+    value = os.environ.get(name)
+    return default if not value else cast(value)
+
+
+def main():
+    # construct the argument parser and parse the arguments; the defaults
+    # come from the app's RECOGNITION_* environment variables
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-a", "--address", default="unix:/tmp/frats-recognition.sock",
+                    help="unix:/path/to/socket or host:port to listen on")
+    ap.add_argument("-d", "--detector", default=env("RECOGNITION_DETECTOR", DETECTOR),
+                    help="path to OpenCV's deep learning face detector")
+    ap.add_argument("-m", "--embedding-model", default=env("RECOGNITION_EMBEDDING_MODEL", EMBEDDING_MODEL),
+                    help="path to OpenCV's deep learning face embedding model")
+    ap.add_argument("-e", "--embeddings", default=STORE,
+                    help="path to the embedding store")
+    ap.add_argument("-M", "--matcher", default="cosine", choices=MATCHERS,
+                    help="how faces are matched when a request names no class (the web app always does)")
+    ap.add_argument("-b", "--backend", default=env("RECOGNITION_DNN_BACKEND", "default"),
+                    choices=list(BACKENDS) + ["auto"],
+                    help="cv2.dnn backend to run the networks on (auto picks the fastest)")
+    ap.add_argument("-t", "--target", default=env("RECOGNITION_DNN_TARGET", "cpu"), choices=TARGETS,
+                    help="cv2.dnn target to run the networks on")
+    ap.add_argument("-p", "--pool-size", type=int, default=env("RECOGNITION_POOL_SIZE", 1, int),
+                    help="number of detector/embedder pairs serving requests in parallel")
+    ap.add_argument("--threads", type=int, default=env("RECOGNITION_THREADS", 0, int) or None,
+                    help="OpenCV threads (default: cores / pool size)")
+    ap.add_argument("--batching", action="store_true", default=env("RECOGNITION_BATCHING", "0") == "1",
+                    help="embed the faces of concurrent requests in shared batches")
+    ap.add_argument("--max-batch", type=int, default=env("RECOGNITION_MAX_BATCH", MAX_BATCH, int),
+                    help="largest number of faces embedded in one batch")
+    ap.add_argument("--max-wait-ms", type=float, default=env("RECOGNITION_MAX_WAIT_MS", MAX_WAIT * 1000, float),
+                    help="longest a face waits for its batch to fill up, in milliseconds")
+    ap.add_argument("--result-cache-size", type=int, default=env("RECOGNITION_RESULT_CACHE_SIZE", 128, int),
+                    help="number of recent results kept for near-duplicate captures (0 disables)")
+    ap.add_argument("--result-cache-ttl", type=float, default=env("RECOGNITION_RESULT_CACHE_TTL", TTL, float),
+                    help="seconds a cached result is reused")
+    ap.add_argument("--duplicate-distance", type=int,
+                    default=env("RECOGNITION_DUPLICATE_DISTANCE", MAX_DISTANCE, int),
+                    help="largest dHash distance (in bits) of a near-duplicate capture")
+    ap.add_argument("--no-quality-gate", action="store_true", default=env("RECOGNITION_QUALITY_GATE", "1") != "1",
+                    help="embed every detected face, however blurry, dark or small")
+    ap.add_argument("--min-sharpness", type=float, default=env("RECOGNITION_MIN_SHARPNESS", MIN_SHARPNESS, float),
+                    help="minimum variance of the Laplacian of a face")
+    ap.add_argument("--min-brightness", type=float,
+                    default=env("RECOGNITION_MIN_BRIGHTNESS", MIN_BRIGHTNESS, float),
+                    help="minimum mean gray level of a face")
+    ap.add_argument("--max-brightness", type=float,
+                    default=env("RECOGNITION_MAX_BRIGHTNESS", MAX_BRIGHTNESS, float),
+                    help="maximum mean gray level of a face")
+    ap.add_argument("--min-face-size", type=int, default=env("RECOGNITION_MIN_FACE_SIZE", MIN_SIZE, int),
+                    help="minimum face size in pixels of an image 600 pixels wide")
+    ap.add_argument("--min-face-confidence", type=float,
+                    default=env("RECOGNITION_MIN_FACE_CONFIDENCE", MIN_CONFIDENCE, float),
+                    help="minimum detection confidence of a face")
+    ap.add_argument("--detect-every", type=int, default=env("RECOGNITION_STREAM_DETECT_EVERY", DETECT_EVERY, int),
+                    help="run the detector on every n-th frame of a stream")
+    ap.add_argument("--skip-distance", type=int,
+                    default=env("RECOGNITION_STREAM_SKIP_DISTANCE", SKIP_DISTANCE, int),
+                    help="skip stream frames within this dHash distance (in bits) of the last one")
+    ap.add_argument("--session-ttl", type=float, default=env("RECOGNITION_STREAM_TTL", SESSION_TTL, float),
+                    help="seconds without a frame after which a stream is closed")
+    ap.add_argument("--reload-interval", type=float, default=RELOAD_INTERVAL,
+                    help="seconds between checks for new students or a retrained model (0 disables)")
+    args = vars(ap.parse_args())
+
+    quality = None if args["no_quality_gate"] else dict(
+        min_sharpness=args["min_sharpness"], min_brightness=args["min_brightness"],
+        max_brightness=args["max_brightness"], min_size=args["min_face_size"],
+        min_confidence=args["min_face_confidence"])
+    recognizer = get_recognizer(
+        streams={"detect_every": args["detect_every"], "skip_distance": args["skip_distance"],
+                 "session_ttl": args["session_ttl"]},
+        detector=args["detector"], embedding_model=args["embedding_model"], embeddings=args["embeddings"],
+        matcher=args["matcher"], backend=args["backend"], target=args["target"], pool_size=args["pool_size"],
+        threads=args["threads"], batching=args["batching"], max_batch=args["max_batch"],
+        max_wait=args["max_wait_ms"] / 1000, result_cache_size=args["result_cache_size"],
+        result_cache_ttl=args["result_cache_ttl"], duplicate_distance=args["duplicate_distance"],
+        quality=quality, reload_interval=args["reload_interval"])
+    server = serve(args["address"], recognizer)
+    print("[INFO] serving face recognition on {}...".format(args["address"]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+# import the necessary packages
+from facial_recognition.result_cache import dhash, hamming
+import itertools
+import threading
+import uuid
+import time
+import cv2
+
+# the detector runs on every DETECT_EVERY-th frame of a stream; in between,
+# the faces are followed by a cheap tracker
+DETECT_EVERY = 5
+
+# a detection continues a track when their boxes overlap by at least MIN_IOU;
+# a track is dropped after MAX_MISSES detections in a row that do not find it
+MIN_IOU = 0.3
+MAX_MISSES = 1
+
+# a track that no student matched (e.g. the face was turned away or half in
+# the frame) is matched again at each detection, at most MAX_ATTEMPTS times
+MAX_ATTEMPTS = 10
+
+# frames whose perceptual hash differs from the last processed frame in at
+# most SKIP_DISTANCE bits are skipped
+SKIP_DISTANCE = 2
+
+# sessions that receive no frame for SESSION_TTL seconds are closed
+SESSION_TTL = 60.0
+
+# the trackers to try, cheapest first; KCF and CSRT are only available in
+# opencv-contrib builds (under cv2.legacy since OpenCV 4.5)
+TRACKERS = ("TrackerKCF_create", "TrackerCSRT_create", "TrackerMIL_create")
+
+
+def create_tracker():
+    # a new tracker of the first available kind, or None when this OpenCV
+    # build has none (every frame is then run through the detector)
+    for module in (cv2, getattr(cv2, "legacy", None)):
+        for name in TRACKERS:
+            factory = getattr(module, name, None)
+            if factory is not None:
+                return factory()
+    return None
+
+
+def iou(a, b):
+    # the intersection over union of two (start_x, start_y, end_x, end_y) boxes
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    intersection = w * h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union
+
+
+class _Track:
+    def __init__(self, track_id, box, name, probability):
+        self.id = track_id
+        self.box = box
+        self.name = name
+        self.probability = probability
+        self.tracker = None
+        self.misses = 0
+        self.attempts = 1
+
+    def start(self, frame, box):
+        # (re)initialize the tracker on a detected box, which also corrects
+        # any drift accumulated since the previous detection
+        self.box = box
+        self.misses = 0
+        self.tracker = create_tracker()
+        if self.tracker is not None:
+            (h, w) = frame.shape[:2]
+            (start_x, start_y) = (max(0, box[0]), max(0, box[1]))
+            (end_x, end_y) = (min(w, box[2]), min(h, box[3]))
+            self.tracker.init(frame, (start_x, start_y, end_x - start_x, end_y - start_y))
+
+    def result(self):
+        return {"track": self.id, "name": self.name, "probability": self.probability, "box": self.box}
+
+
+class StreamSession:
+    """Recognizes the faces in a stream of frames (e.g. a camera at the door).
+
+    The detector runs only every detect_every frames and the faces are tracked
+    in between; each face is embedded and matched when its track starts (and
+    at the next few detections while it matches no student), so a student
+    walking past costs about one recognition however many frames they appear
+    in."""
+
+    def __init__(self, engine, key, candidates=None, detect_every=DETECT_EVERY, skip_distance=SKIP_DISTANCE):
+        self.engine = engine
+        self.key = key
+        self.candidates = candidates
+        self.detect_every = detect_every
+        self.skip_distance = skip_distance
+        self._last_hash = None
+        self.last_seen = time.monotonic()
+        self._lock = threading.Lock()
+        self._track_ids = itertools.count(1)
+        self._tracking = create_tracker() is not None
+        self.tracks = []
+
+        # metrics
+        self.frames = 0
+        self.skipped = 0
+        self.detections = 0
+        self.embedded = 0
+
+    def process(self, frame):
+        # returns the faces that are new or newly recognized in this frame;
+        # the frames of one session are processed in order
+        with self._lock:
+            self.last_seen = time.monotonic()
+
+            # nothing moved since the last processed frame (e.g. an empty
+            # doorway), so there is nothing new to detect or track
+            frame_hash = dhash(frame)
+            if self._last_hash is not None and hamming(frame_hash, self._last_hash) <= self.skip_distance:
+                self.skipped += 1
+                return []
+            self._last_hash = frame_hash
+
+            if self.frames % self.detect_every == 0 or not self._tracking:
+                started = self._detect(frame)
+            else:
+                self._track(frame)
+                started = []
+            self.frames += 1
+            return [track.result() for track in started]
+
+    def _detect(self, frame):
+        self.detections += 1
+        faces = self.engine.detect(frame)
+
+        # greedily pair every detection with the track it overlaps most
+        pairs = sorted(((iou(face["box"], track.box), i, track) for (i, face) in enumerate(faces)
+                        for track in self.tracks), key=lambda p: p[0], reverse=True)
+        matched_faces = set()
+        matched_tracks = set()
+        retries = {}
+        for (overlap, i, track) in pairs:
+            if overlap < MIN_IOU:
+                break
+            if i in matched_faces or track.id in matched_tracks:
+                continue
+            matched_faces.add(i)
+            matched_tracks.add(track.id)
+            track.start(frame, faces[i]["box"])
+            if track.name == "unknown" and track.attempts < MAX_ATTEMPTS:
+                retries[i] = track
+
+        for track in self.tracks:
+            if track.id not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= MAX_MISSES]
+
+        # only the faces that are not followed yet, or whose track is still
+        # unknown, are embedded and matched; new faces rejected by the quality
+        # gate are not tracked, so they are tried again at the next detection
+        # (e.g. once the student is closer)
+        pending = [(face, retries.get(i)) for (i, face) in enumerate(faces) if i not in matched_faces or i in retries]
+        reasons = self.engine.screen([face for (face, _) in pending], frame)
+        pending = [entry for (entry, reason) in zip(pending, reasons) if reason is None]
+        if not pending:
+            return []
+        self.embedded += len(pending)
+        matches = self.engine.identify([face["face"] for (face, _) in pending], self.candidates)
+        started = []
+        for ((face, track), (name, score)) in zip(pending, matches):
+            if track is None:
+                track = _Track(next(self._track_ids), face["box"], name, score)
+                track.start(frame, face["box"])
+                self.tracks.append(track)
+                started.append(track)
+                continue
+            track.attempts += 1
+            if name != "unknown":
+                (track.name, track.probability) = (name, score)
+                started.append(track)
+        return started
+
+    def _track(self, frame):
+        tracks = []
+        for track in self.tracks:
+            (ok, (x, y, w, h)) = track.tracker.update(frame)
+            if ok:
+                track.box = [int(x), int(y), int(x + w), int(y + h)]
+                tracks.append(track)
+        self.tracks = tracks
+
+    def stats(self):
+        return {"frames": self.frames, "skipped": self.skipped, "detections": self.detections,
+                "embedded": self.embedded, "tracks": len(self.tracks)}
+
+
+class StreamSessions:
+    """The open stream sessions of this process, closed after session_ttl
+    seconds without a frame."""
+
+    def __init__(self, detect_every=DETECT_EVERY, skip_distance=SKIP_DISTANCE, session_ttl=SESSION_TTL):
+        self.detect_every = detect_every
+        self.skip_distance = skip_distance
+        self.session_ttl = session_ttl
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+        # metrics of the sessions that have been closed
+        self._closed = {"frames": 0, "skipped": 0, "detections": 0, "embedded": 0}
+
+    def open(self, engine, key, candidates=None, session_id=None):
+        # a session_id is given to continue a stream opened by another process
+        self._expire()
+        session_id = session_id or uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = StreamSession(engine, key, candidates, self.detect_every,
+                                                          self.skip_distance)
+        return session_id
+
+    def get(self, session_id):
+        self._expire()
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._retire(session)
+
+    def _retire(self, session):
+        for (k, v) in session.stats().items():
+            if k in self._closed:
+                self._closed[k] += v
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [session_id for (session_id, session) in self._sessions.items()
+                       if now - session.last_seen > self.session_ttl]
+            for session_id in expired:
+                self._retire(self._sessions.pop(session_id))
+
+    def stats(self):
+        with self._lock:
+            totals = dict(self._closed)
+            for session in self._sessions.values():
+                for k in totals:
+                    totals[k] += getattr(session, k)
+            totals["sessions"] = len(self._sessions)
+        received = totals["frames"] + totals["skipped"]
+        totals["embedded_per_frame"] = totals["embedded"] / received if received else 0.0
+        return totals
+
+
+_stream_sessions = None
+_stream_sessions_lock = threading.Lock()
+
+
+def get_stream_sessions(**config):
+    # one registry of stream sessions per process
+    global _stream_sessions
+    if _stream_sessions is None:
+        with _stream_sessions_lock:
+            if _stream_sessions is None:
+                _stream_sessions = StreamSessions(**config)
+    return _stream_sessions
@@ -1,164 +1,264 @@
 # USAGE
-# python extract_embeddings.py --dataset dataset --embeddings output/embeddings.pickle \
-#	--detector face_detection_model --embedding-model openface_nn4.small2.v1.t7
+# python -m facial_recognition.train_facial_recognition_model --dataset facial_recognition/dataset \
+#	--embeddings facial_recognition/output/embeddings \
+#	--recognizer facial_recognition/output/recognizer.pickle --le facial_recognition/output/le.pickle
 
 # import the necessary packages
+from facial_recognition.embedding_cache import EmbeddingCache, CACHE, file_digest, model_version
+from facial_recognition.embedding_store import DTYPES, load_embeddings, save_store, store_lock
+from facial_recognition.nets import FaceNets, DETECTOR, EMBEDDING_MODEL, CONFIDENCE, PREPROCESSING, model_files, read_image
+from facial_recognition.engine import RECOGNIZER, LE
+from facial_recognition.model_registry import REGISTRY, publish
+from facial_recognition.gallery import EMBEDDINGS
+from multiprocessing import Pool
 from imutils import paths
-import numpy as np
-import imutils
 import cv2
 import os
 
 # import the necessary packages
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.preprocessing import LabelEncoder
 from sklearn.svm import SVC
+import numpy as np
 import argparse
 import pickle
 
-# construct the argument parser and parse the arguments
-ap = argparse.ArgumentParser()
-ap.add_argument("-i", "--dataset", default='dataset',
-                help="path to input directory of faces + images")
-ap.add_argument("-e", "--embeddings", default='output/embeddings.pickle',
-                help="path to output serialized db of facial embeddings")
-ap.add_argument("-d", "--detector", default='face_detection_model',
-                help="path to OpenCV's deep learning face detector")
-ap.add_argument("-m", "--embedding-model", default='openface_nn4.small2.v1.t7',
-                help="path to OpenCV's deep learning face embedding model")
-ap.add_argument("-c", "--confidence", type=float, default=0.5,
-                help="minimum probability to filter weak detections")
-args = vars(ap.parse_args())
-
-print("[INFO] Extract Embeddings")
-# load our serialized face detector from disk
-print("[INFO] loading face detector...")
-protoPath = os.path.sep.join([args["detector"], "deploy.prototxt"])
-modelPath = os.path.sep.join([args["detector"],
-                              "res10_300x300_ssd_iter_140000.caffemodel"])
-detector = cv2.dnn.readNetFromCaffe(protoPath, modelPath)
-
-# load our serialized face embedding model from disk
-print("[INFO] loading face recognizer...")
-embedder = cv2.dnn.readNetFromTorch(args["embedding_model"])
-
-# grab the paths to the input images in our dataset
-print("[INFO] quantifying faces...")
-imagePaths = list(paths.list_images(args["dataset"]))
-
-# initialize our lists of extracted facial embeddings and
-# corresponding people names
-knownEmbeddings = []
-knownNames = []
-
-# initialize the total number of faces processed
-total = 0
-
-# loop over the image paths
-for (i, imagePath) in enumerate(imagePaths):
-    # extract the person name from the image path
-    print("[INFO] processing image {}/{}".format(i + 1,
-                                                 len(imagePaths)))
-    name = imagePath.split(os.path.sep)[-2]
-
-    # load the image, resize it to have a width of 600 pixels (while
-    # maintaining the aspect ratio), and then grab the image
-    # dimensions
-    image = cv2.imread(imagePath)
-    image = imutils.resize(image, width=600)
-    (h, w) = image.shape[:2]
-
-    # construct a blob from the image
-    imageBlob = cv2.dnn.blobFromImage(
-        cv2.resize(image, (300, 300)), 1.0, (300, 300),
-        (104.0, 177.0, 123.0), swapRB=False, crop=False)
-
-    # apply OpenCV's deep learning-based face detector to localize
-    # faces in the input image
-    detector.setInput(imageBlob)
-    detections = detector.forward()
-
-    # ensure at least one face was found
-    if len(detections) > 0:
-        # we're making the assumption that each image has only ONE
-        # face, so find the bounding box with the largest probability
-        i = np.argmax(detections[0, 0, :, 2])
-        confidence = detections[0, 0, i, 2]
-
-        # ensure that the detection with the largest probability also
-        # means our minimum probability test (thus helping filter out
-        # weak detections)
-        if confidence > args["confidence"]:
-            # compute the (x, y)-coordinates of the bounding box for
-            # the face
-            box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-            (startX, startY, endX, endY) = box.astype("int")
-
-            # extract the face ROI and grab the ROI dimensions
-            face = image[startY:endY, startX:endX]
-            (fH, fW) = face.shape[:2]
-
-            # ensure the face width and height are sufficiently large
-            if fW < 20 or fH < 20:
-                continue
-
-            # construct a blob for the face ROI, then pass the blob
-            # through our face embedding model to obtain the 128-d
-            # quantification of the face
-            faceBlob = cv2.dnn.blobFromImage(face, 1.0 / 255,
-                                             (96, 96), (0, 0, 0), swapRB=True, crop=False)
-            embedder.setInput(faceBlob)
-            vec = embedder.forward()
-
-            # add the name of the person + corresponding face
-            # embedding to their respective lists
+# the classifiers that can be trained on the embeddings; svc calibrates its
+# probabilities with an internal cross-validation and libsvm grows
+# super-linearly with the number of samples, while sgd and logreg grow
+# linearly and can continue from a previous fit
+CLASSIFIERS = ("svc", "sgd", "logreg")
+
+
+# the networks of a worker process, loaded once by init_worker()
+worker_nets = None
+worker_confidence = CONFIDENCE
+
+
+def init_worker(detector, embedding_model, confidence, threads=None):
+    # every worker process loads its own copy of the networks; in a pool,
+    # OpenCV's own threading is disabled since the pool already uses every core
+    global worker_nets, worker_confidence
+    if threads is not None:
+        cv2.setNumThreads(threads)
+    worker_nets = FaceNets(detector, embedding_model)
+    worker_confidence = confidence
+
+
+def embed_image(imagePath):
+    # detect the (single) face in the image and compute its 128-d embedding
+    image = read_image(imagePath)
+    if image is None:
+        return None
+    return worker_nets.embed_largest_face(image, worker_confidence)
+
+
+def embed_images(imagePaths, args):
+    # the entries are returned in the order of imagePaths whether the images
+    # are processed serially or by a pool of worker processes
+    if not imagePaths:
+        return []
+    initargs = (args["detector"], args["embedding_model"], args["confidence"])
+    if args["workers"] <= 1:
+        init_worker(*initargs)
+        results = map(embed_image, imagePaths)
+        pool = None
+    else:
+        pool = Pool(args["workers"], initializer=init_worker, initargs=initargs + (1,))
+        results = pool.imap(embed_image, imagePaths, chunksize=args["chunk_size"])
+
+    entries = []
+    for (i, entry) in enumerate(results):
+        print("[INFO] processing image {}/{}".format(i + 1,
+                                                     len(imagePaths)))
+        entries.append(entry)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return entries
+
+
+def extract_embeddings(args):
+    print("[INFO] Extract Embeddings")
+
+    # embeddings are cached by image content, so only new or modified images
+    # go through the networks; the cache is invalidated when the networks or
+    # the confidence threshold or the preprocessing change
+    version = model_version(*model_files(args["detector"]), *model_files(args["embedding_model"]),
+                            confidence=args["confidence"], preprocessing=PREPROCESSING)
+    cache = EmbeddingCache(args["cache"], version) if args["cache"] else None
+
+    # grab the paths to the input images in our dataset
+    print("[INFO] quantifying faces...")
+    imagePaths = sorted(paths.list_images(args["dataset"]))
+
+    # run the images that are not cached yet through the networks
+    digests = [file_digest(imagePath) if cache is not None else imagePath for imagePath in imagePaths]
+    pending = [(imagePath, digest) for (imagePath, digest) in zip(imagePaths, digests)
+               if cache is None or digest not in cache]
+    entries = dict(zip([digest for (_, digest) in pending],
+                       embed_images([imagePath for (imagePath, _) in pending], args)))
+    if cache is not None:
+        for (digest, entry) in entries.items():
+            cache.put(digest, entry)
+
+    # initialize our lists of extracted facial embeddings and
+    # corresponding people names
+    knownEmbeddings = []
+    knownNames = []
+
+    # initialize the total number of faces processed
+    total = 0
+
+    # loop over the image paths
+    for (imagePath, digest) in zip(imagePaths, digests):
+        # extract the person name from the image path
+        name = imagePath.split(os.path.sep)[-2]
+        entry = entries[digest] if digest in entries else cache.get(digest)
+
+        # add the name of the person + corresponding face
+        # embedding to their respective lists (copied to a plain float32
+        # array so that the store is byte-identical to a serial run)
+        if entry is not None:
             knownNames.append(name)
-            knownEmbeddings.append(vec.flatten())
+            knownEmbeddings.append(entry["vec"].flatten().astype("float32"))
             total += 1
 
-# dump the facial embeddings + names to disk
-print("[INFO] serializing {} encodings...".format(total))
-data = {"embeddings": knownEmbeddings, "names": knownNames}
-f = open(args["embeddings"], "wb")
-f.write(pickle.dumps(data))
-f.close()
+    if cache is not None:
+        removed = cache.prune(digests)
+        cache.save()
+        print("[INFO] {} image(s) from cache, {} embedded, {} stale cache entries dropped".format(
+            len(imagePaths) - len(pending), len(pending), removed))
 
-print()
+    # write the facial embeddings + names to the embedding store
+    print("[INFO] serializing {} encodings...".format(total))
+    save_store(args["embeddings"], knownEmbeddings, knownNames, args["dtype"])
 
-# USAGE
-# python train_model.py --embeddings output/embeddings.pickle \
-#	--recognizer output/recognizer.pickle --le output/le.pickle
-
-# construct the argument parser and parse the arguments
-ap = argparse.ArgumentParser()
-ap.add_argument("-e", "--embeddings", default='output/embeddings.pickle',
-                help="path to serialized db of facial embeddings")
-ap.add_argument("-r", "--recognizer", default='output/recognizer.pickle',
-                help="path to output model trained to recognize faces")
-ap.add_argument("-l", "--le", default='output/le.pickle',
-                help="path to output label encoder")
-args = vars(ap.parse_args())
-
-# load the face embeddings
-print("[INFO] loading face embeddings...")
-data = pickle.loads(open(args["embeddings"], "rb").read())
-
-# encode the labels
-print("[INFO] encoding labels...")
-le = LabelEncoder()
-labels = le.fit_transform(data["names"])
-
-# train the model used to accept the 128-d embeddings of the face and
-# then produce the actual face recognition
-print("[INFO] training model...")
-recognizer = SVC(C=1.0, kernel="linear", probability=True)
-recognizer.fit(data["embeddings"], labels)
-
-# write the actual face recognition model to disk
-f = open(args["recognizer"], "wb")
-f.write(pickle.dumps(recognizer))
-f.close()
-
-# write the label encoder to disk
-f = open(args["le"], "wb")
-f.write(pickle.dumps(le))
-f.close()
+
+def build_classifier(name):
+    if name == "svc":
+        return SVC(C=1.0, kernel="linear", probability=True)
+    if name == "sgd":
+        # the modified Huber loss is what gives SGD a predict_proba()
+        return SGDClassifier(loss="modified_huber", alpha=1e-4, max_iter=20, tol=1e-3, n_jobs=-1,
+                             random_state=42)
+    if name == "logreg":
+        return LogisticRegression(C=10.0, max_iter=500, warm_start=True)
+    raise ValueError(f"unknown classifier '{name}', expected one of {', '.join(CLASSIFIERS)}")
+
+
+def previous_classifier(args, name, le):
+    # the previously trained recognizer, when it is of the same kind and was
+    # trained on the same students, so that training can continue from it
+    try:
+        with open(args["recognizer"], "rb") as f:
+            recognizer = pickle.loads(f.read())
+        with open(args["le"], "rb") as f:
+            previous_le = pickle.loads(f.read())
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if not isinstance(recognizer, type(build_classifier(name))) \
+            or not np.array_equal(previous_le.classes_, le.classes_):
+        return None
+    return recognizer
+
+
+def fit_classifier(name, embeddings, labels, previous=None, epochs=5):
+    # fit from scratch, or continue from a previous fit: logreg starts its
+    # solver from the previous coefficients (warm_start), sgd runs a few more
+    # passes over the data with partial_fit()
+    if previous is None:
+        recognizer = build_classifier(name)
+        recognizer.fit(embeddings, labels)
+        return recognizer
+    if name == "sgd":
+        classes = np.unique(labels)
+        for _ in range(epochs):
+            previous.partial_fit(embeddings, labels, classes=classes)
+        return previous
+    previous.fit(embeddings, labels)
+    return previous
+
+
+def train_model(args):
+    # load the face embeddings
+    print("[INFO] loading face embeddings...")
+    (embeddings, names) = load_embeddings(args["embeddings"])
+
+    # encode the labels
+    print("[INFO] encoding labels...")
+    le = LabelEncoder()
+    labels = le.fit_transform(names)
+
+    # train the model used to accept the 128-d embeddings of the face and
+    # then produce the actual face recognition
+    previous = None
+    if args["warm_start"] and args["classifier"] != "svc":
+        previous = previous_classifier(args, args["classifier"], le)
+        if previous is None:
+            print("[INFO] no compatible previous model, training from scratch")
+    print("[INFO] training {} model...".format(args["classifier"]))
+    recognizer = fit_classifier(args["classifier"], embeddings, labels, previous)
+
+    # write the actual face recognition model to disk
+    f = open(args["recognizer"], "wb")
+    f.write(pickle.dumps(recognizer))
+    f.close()
+
+    # write the label encoder to disk
+    f = open(args["le"], "wb")
+    f.write(pickle.dumps(le))
+    f.close()
+
+    # publish the model as a new registry version, which running web workers
+    # load in the background and swap in
+    if args["registry"]:
+        version = publish(recognizer, le, args["registry"], classifier=args["classifier"],
+                          identities=len(le.classes_), encodings=len(names))
+        print("[INFO] published recognizer version {} to {}".format(version, args["registry"]))
+
+
+def main():
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-i", "--dataset", default=os.path.join('facial_recognition', 'dataset'),
+                    help="path to input directory of faces + images")
+    ap.add_argument("-e", "--embeddings", default=EMBEDDINGS,
+                    help="path to output embedding store")
+    ap.add_argument("-t", "--dtype", default=None, choices=DTYPES,
+                    help="precision of the stored embeddings (default: keep the store's)")
+    ap.add_argument("-d", "--detector", default=DETECTOR,
+                    help="path to OpenCV's deep learning face detector")
+    ap.add_argument("-m", "--embedding-model", default=EMBEDDING_MODEL,
+                    help="path to OpenCV's deep learning face embedding model")
+    ap.add_argument("-c", "--confidence", type=float, default=CONFIDENCE,
+                    help="minimum probability to filter weak detections")
+    ap.add_argument("-k", "--cache", default=CACHE,
+                    help="path to the embedding cache (empty to disable it)")
+    ap.add_argument("-w", "--workers", type=int, default=1,
+                    help="number of processes extracting embeddings in parallel")
+    ap.add_argument("--chunk-size", type=int, default=16,
+                    help="number of images handed to a worker process at a time")
+    ap.add_argument("-C", "--classifier", default="svc", choices=CLASSIFIERS,
+                    help="classifier trained on the embeddings")
+    ap.add_argument("--warm-start", action="store_true",
+                    help="continue from the previous sgd/logreg model when the students are unchanged")
+    ap.add_argument("-r", "--recognizer", default=RECOGNIZER,
+                    help="path to output model trained to recognize faces")
+    ap.add_argument("-l", "--le", default=LE,
+                    help="path to output label encoder")
+    ap.add_argument("-g", "--registry", default=REGISTRY,
+                    help="model registry to publish the trained model to (empty to skip)")
+    args = vars(ap.parse_args())
+
+    # the store is rebuilt from the dataset, so students enrolled meanwhile
+    # (whose images enroll copies into the dataset) wait for it to be written
+    with store_lock(args["embeddings"]):
+        extract_embeddings(args)
+    print()
+    train_model(args)
+
+
+if __name__ == '__main__':
+    main()
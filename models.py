@@ -4,6 +4,7 @@ from flask_login import LoginManager, UserMixin
 from flask_bcrypt import Bcrypt
 from flask_mail import Mail
 
+import tempfile
 import os
 
 
@@ -11,6 +12,7 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(12).hex()
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024    # largest upload (e.g. webcam capture) accepted
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
@@ -22,6 +24,43 @@ app.config['MAIL_USE_TLS'] = True
 app.config['MAIL_USERNAME'] = os.environ.get('EMAIL_USER')
 app.config['MAIL_PASSWORD'] = os.environ.get('EMAIL_PASS')
 mail = Mail(app)
+app.config['RECOGNITION_CAPTURE_MAX_WIDTH'] = int(os.environ.get('RECOGNITION_CAPTURE_MAX_WIDTH', 480))   # pixels
+app.config['RECOGNITION_CAPTURE_JPEG_QUALITY'] = int(os.environ.get('RECOGNITION_CAPTURE_JPEG_QUALITY', 80))
+app.config['RECOGNITION_CAPTURE_CROP'] = float(os.environ.get('RECOGNITION_CAPTURE_CROP', 0.75))   # centered, 1 = none
+app.config['RECOGNITION_SERVICE'] = os.environ.get('RECOGNITION_SERVICE')    # unix:/path or host:port, None = in-process
+app.config['RECOGNITION_SERVICE_TIMEOUT'] = float(os.environ.get('RECOGNITION_SERVICE_TIMEOUT', 10))    # seconds
+app.config['RECOGNITION_DETECTOR'] = os.environ.get(    # Caffe model directory or .onnx
+    'RECOGNITION_DETECTOR', os.path.join('facial_recognition', 'face_detection_model'))
+app.config['RECOGNITION_EMBEDDING_MODEL'] = os.environ.get(    # .t7 or .onnx
+    'RECOGNITION_EMBEDDING_MODEL', os.path.join('facial_recognition', 'openface_nn4.small2.v1.t7'))
+app.config['RECOGNITION_DNN_BACKEND'] = os.environ.get('RECOGNITION_DNN_BACKEND', 'default')     # default/opencv/openvino/auto
+app.config['RECOGNITION_DNN_TARGET'] = os.environ.get('RECOGNITION_DNN_TARGET', 'cpu')     # cpu/cpu_fp16
+app.config['RECOGNITION_POOL_SIZE'] = int(os.environ.get('RECOGNITION_POOL_SIZE', 1))     # detector/embedder pairs
+app.config['RECOGNITION_THREADS'] = int(os.environ.get('RECOGNITION_THREADS', 0)) or None    # cv2.setNumThreads
+app.config['RECOGNITION_BATCHING'] = os.environ.get('RECOGNITION_BATCHING') == '1'
+app.config['RECOGNITION_MAX_BATCH'] = int(os.environ.get('RECOGNITION_MAX_BATCH', 16))
+app.config['RECOGNITION_MAX_WAIT_MS'] = float(os.environ.get('RECOGNITION_MAX_WAIT_MS', 5))
+app.config['RECOGNITION_RESULT_CACHE_SIZE'] = int(os.environ.get('RECOGNITION_RESULT_CACHE_SIZE', 128))   # 0 disables
+app.config['RECOGNITION_RESULT_CACHE_TTL'] = float(os.environ.get('RECOGNITION_RESULT_CACHE_TTL', 10))  # seconds
+app.config['RECOGNITION_DUPLICATE_DISTANCE'] = int(os.environ.get('RECOGNITION_DUPLICATE_DISTANCE', 8))  # dHash bits
+app.config['RECOGNITION_QUALITY_GATE'] = os.environ.get('RECOGNITION_QUALITY_GATE', '1') == '1'
+app.config['RECOGNITION_MIN_SHARPNESS'] = float(os.environ.get('RECOGNITION_MIN_SHARPNESS', 20))   # Laplacian variance
+app.config['RECOGNITION_MIN_BRIGHTNESS'] = float(os.environ.get('RECOGNITION_MIN_BRIGHTNESS', 40))   # mean gray level
+app.config['RECOGNITION_MAX_BRIGHTNESS'] = float(os.environ.get('RECOGNITION_MAX_BRIGHTNESS', 220))
+app.config['RECOGNITION_MIN_FACE_SIZE'] = int(os.environ.get('RECOGNITION_MIN_FACE_SIZE', 40))     # pixels at 600 pixels wide
+app.config['RECOGNITION_MIN_FACE_CONFIDENCE'] = float(os.environ.get('RECOGNITION_MIN_FACE_CONFIDENCE', 0.6))
+app.config['RECOGNITION_JOB_WORKERS'] = int(os.environ.get('RECOGNITION_JOB_WORKERS', 2))
+app.config['RECOGNITION_MAX_PENDING_JOBS'] = int(os.environ.get('RECOGNITION_MAX_PENDING_JOBS', 32))
+app.config['RECOGNITION_JOB_DIR'] = os.environ.get(    # shared by the web workers, so any of them can answer a poll
+    'RECOGNITION_JOB_DIR', os.path.join(tempfile.gettempdir(), 'frats-recognition-jobs'))
+app.config['RECOGNITION_STREAM_DETECT_EVERY'] = int(os.environ.get('RECOGNITION_STREAM_DETECT_EVERY', 5))   # frames
+app.config['RECOGNITION_STREAM_SKIP_DISTANCE'] = int(os.environ.get('RECOGNITION_STREAM_SKIP_DISTANCE', 2))
+app.config['RECOGNITION_STREAM_TTL'] = float(os.environ.get('RECOGNITION_STREAM_TTL', 60))     # idle seconds
+app.config['ATTENDANCE_WRITE_BEHIND'] = os.environ.get('ATTENDANCE_WRITE_BEHIND', '1') == '1'
+app.config['ATTENDANCE_JOURNAL_DIR'] = os.environ.get('ATTENDANCE_JOURNAL_DIR', 'attendance_journal')
+app.config['ATTENDANCE_FLUSH_INTERVAL_MS'] = float(os.environ.get('ATTENDANCE_FLUSH_INTERVAL_MS', 200))
+app.config['ATTENDANCE_FLUSH_BATCH'] = int(os.environ.get('ATTENDANCE_FLUSH_BATCH', 100))     # marks
+app.config['ATTENDANCE_JOURNAL_FSYNC'] = os.environ.get('ATTENDANCE_JOURNAL_FSYNC') == '1'    # survive power loss
 
 
 @login_manager.user_loader
@@ -0,0 +1,162 @@
+from collections import namedtuple
+from sqlalchemy import func
+import threading
+import time
+
+from models import db, Users, Staffs, Students, Indexes, StaffInCharged, IndexDates, Attendance
+
+
+RosterEntry = namedtuple('RosterEntry', ['attendance_id', 'name', 'seat_no'])
+
+# how often (in seconds) a process drops the rosters of class dates whose
+# attendance taking was stopped, possibly by another process
+SWEEP_INTERVAL = 30.0
+
+# the longest (in seconds) a cached roster is used; enrolments are checked on
+# every use, edited names, seats and staff are picked up after this
+ROSTER_TTL = 60.0
+
+
+class Roster:
+    """The students of one class date, keyed by matric number, loaded with a
+    single query when the attendance taking starts instead of lazily by every
+    kiosk request. The email of the class' lab technician, who validates
+    manual attendance, is looked up along with it."""
+
+    def __init__(self, class_date_id, class_name, date, room, lab_tech_email, entries, started=False):
+        self.class_date_id = class_date_id
+        self.class_name = class_name
+        self.date = date
+        self.room = room
+        self.lab_tech_email = lab_tech_email
+        self.entries = entries
+        self.matric_nos = sorted(entries)
+        self.started = started
+        self.loaded_at = time.monotonic()
+
+    @property
+    def stamp(self):
+        # the number and the highest id of the class date's attendance rows,
+        # which change when a student is added to or removed from the class
+        return len(self.entries), max((entry.attendance_id for entry in self.entries.values()), default=None)
+
+    def get(self, matric_no):
+        return self.entries.get(matric_no)
+
+    def names(self, matric_nos):
+        # the student name of every given matric number of the class
+        return {matric_no: self.entries[matric_no].name for matric_no in matric_nos if matric_no in self.entries}
+
+    def sheet(self):
+        # the entries in enrolment order, with their matric numbers
+        return sorted(self.entries.items(), key=lambda item: item[1].attendance_id)
+
+    def __contains__(self, matric_no):
+        return matric_no in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def load_roster(class_date_id):
+    class_date = db.session.query(IndexDates.date, IndexDates.attendance_started, Indexes.id, Indexes.className,
+                                  Indexes.room).join(Indexes).filter(IndexDates.id == class_date_id).first()
+    if class_date is None:
+        return None
+    lab_tech = db.session.query(Users.email).join(Staffs).join(StaffInCharged) \
+        .filter(StaffInCharged.indexId == class_date.id, Staffs.role == 'lab technician').first()
+    rows = db.session.query(Students.matricNo, Attendance.id, Students.name, Attendance.seatNo).join(Attendance) \
+        .filter(Attendance.indexDateId == class_date_id).all()
+    entries = {matric_no: RosterEntry(attendance_id, name, seat_no)
+               for (matric_no, attendance_id, name, seat_no) in rows}
+    return Roster(class_date_id, class_date.className, class_date.date, class_date.room,
+                  lab_tech.email if lab_tech else "", entries, class_date.attendance_started)
+
+
+def roster_stamp(class_date_id):
+    # see Roster.stamp; a single aggregate query
+    return tuple(db.session.query(func.count(Attendance.id), func.max(Attendance.id))
+                 .filter(Attendance.indexDateId == class_date_id).one())
+
+
+def attendance_statuses(class_date_id, attendance_ids=None):
+    # the current attendance of every (or every given) student of a class
+    # date, by attendance id
+    query = db.session.query(Attendance.id, Attendance.attendance).filter(Attendance.indexDateId == class_date_id)
+    if attendance_ids is not None:
+        query = query.filter(Attendance.id.in_(attendance_ids))
+    return dict(query.all())
+
+
+def mark_attendance(attendance_ids):
+    # mark the given attendances present with a single UPDATE and return how
+    # many of them were not marked yet
+    if not attendance_ids:
+        return 0
+    marked = Attendance.query.filter(Attendance.id.in_(attendance_ids), Attendance.attendance != 'Present') \
+        .update({Attendance.attendance: 'Present'}, synchronize_session=False)
+    db.session.commit()
+    return marked
+
+
+_rosters = {}
+_rosters_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def get_roster(class_date_id, ttl=ROSTER_TTL):
+    # the roster of a class date, or None for an unknown class date; the
+    # rosters of class dates taking attendance are cached, and a cached roster
+    # is reloaded when it is older than ttl or when the class' enrolments were
+    # changed, e.g. by another process
+    roster = _rosters.get(class_date_id)
+    if roster is not None and time.monotonic() - roster.loaded_at < ttl \
+            and roster_stamp(class_date_id) == roster.stamp:
+        return roster
+    roster = load_roster(class_date_id)
+    with _rosters_lock:
+        if roster is not None and roster.started:
+            _rosters[class_date_id] = roster
+        else:
+            _rosters.pop(class_date_id, None)
+    return roster
+
+
+def warm_roster(class_date_id):
+    # (re)load the roster of a class date whose attendance taking starts
+    roster = load_roster(class_date_id)
+    with _rosters_lock:
+        if roster is None:
+            _rosters.pop(class_date_id, None)
+        else:
+            _rosters[class_date_id] = roster
+    return roster
+
+
+def evict_roster(class_date_id=None):
+    # drop the roster of a class date, or every roster when enrolments or
+    # staff change
+    with _rosters_lock:
+        if class_date_id is None:
+            _rosters.clear()
+        else:
+            _rosters.pop(class_date_id, None)
+
+
+def sweep_rosters(interval=SWEEP_INTERVAL):
+    # drop the cached rosters of class dates that are no longer taking
+    # attendance (stop_attendance only evicts in the process handling it) and
+    # return their ids; checked at most every interval seconds
+    global _last_sweep
+    now = time.monotonic()
+    if not _rosters or now - _last_sweep < interval:
+        return []
+    _last_sweep = now
+    cached = list(_rosters)
+    started = {class_date_id for (class_date_id,) in db.session.query(IndexDates.id)
+               .filter(IndexDates.id.in_(cached), IndexDates.attendance_started).all()}
+    stopped = [class_date_id for class_date_id in cached if class_date_id not in started]
+    with _rosters_lock:
+        for class_date_id in stopped:
+            _rosters.pop(class_date_id, None)
+    return stopped